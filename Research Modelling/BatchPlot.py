@@ -0,0 +1,187 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+import matplotlib
+# Headless: figures are only ever written to file, so no display is needed.
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from TrajectoryStore import TrajectoryReader, HEADER
+from CurveFit import Curves
+from SweepTools import SplitOptions
+import numpy as np
+import multiprocessing
+import glob
+import os
+import re
+import sys
+
+# Figure size in inches; with 'dpi', the width in pixels sets the number of decimation bins.
+FIGSIZE = (8, 6)
+
+def MinMaxDecimate(x, y, bins, logx=False):
+    """MinMaxDecimate function. Thins a dense line to at most two points per bin of the x range, the lowest and
+    highest y in each bin, kept in their original order. With one bin per pixel column the plotted line looks the
+    same, spikes and all, while matplotlib draws a few thousand points instead of millions.
+    Arguments: 'x' & 'y' are the line's arrays, x sorted. 'bins' is the number of bins, e.g. the figure width in
+    pixels. 'logx' bins in log10(x), for log x axes. Output: tuple of the thinned x & y arrays."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) <= 2 * bins:
+        return((x, y))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        position = np.log10(x) if logx else x
+    finite = np.isfinite(position)
+    if not finite.any():
+        return((x, y))
+    low, high = position[finite].min(), position[finite].max()
+    width = (high - low) / bins if high > low else 1.0
+    # Positions that are not finite, such as log10(0), are binned apart, before the cast could make garbage of them.
+    binned = np.clip(((np.where(finite, position, low) - low) / width).astype(int), 0, bins - 1)
+    binned[~finite] = -1
+    # Sorting by bin, then y, puts each bin's lowest y first and highest last. nan sorts last, so is dropped.
+    order = np.lexsort((y, binned))
+    starts = np.nonzero(np.diff(np.concatenate(([-2], binned[order]))))[0]
+    ends = np.concatenate((starts[1:], [len(order)])) - 1
+    valid = np.nonzero(~np.isnan(y[order]))[0]
+    lasts = valid[np.maximum(np.searchsorted(valid, ends, side="right") - 1, 0)] if len(valid) else ends
+    keep = np.unique(np.concatenate((order[starts], order[np.maximum(lasts, starts)])))
+    return((x[keep], y[keep]))
+
+def _Name(text):
+    "Returns 'text' with every character that is not safe in a file name replaced by '_'."
+    return(re.sub(r"[^A-Za-z0-9_.+-]", "_", text))
+
+def ResponseFigures(filenames, dosename, species, overlay):
+    """Builds the dose-response figures of results files, as CurveFit.py reads them. 'overlay' is "models", one
+    figure per species with a line per model, or "species", one figure per model with a line per species.
+    Output: list of figure dictionaries for Render, lines not yet decimated."""
+    figures = {}
+    for model, name, doses, responses in Curves(filenames, dosename, species):
+        order = np.argsort(doses, kind="mergesort")
+        key, label = (name, model) if overlay == "models" else (model, name)
+        if key not in figures:
+            figures[key] = {"title": key, "xlabel": dosename or "Input", "ylabel": "Output concentration (mmol/ml)",
+                            "stem": key, "lines": []}
+        figures[key]["lines"].append((label, doses[order], responses[order]))
+    return([figures[key] for key in sorted(figures)])
+
+def TrajectoryFigures(dirname, species, bins, logx):
+    """Builds one figure per species of a trajectory store, with a line per sweep point. Each time course is read
+    and decimated in turn, so the store is never held in memory whole. Output: list of figure dictionaries."""
+    reader = TrajectoryReader(dirname)
+    try:
+        names = species or reader.columns[1:]
+        columns = [reader.columns.index(name) for name in names if name in reader.columns]
+        stem = os.path.basename(os.path.normpath(dirname))
+        figures = [{"title": stem + ": " + reader.columns[c], "xlabel": "Time (s)",
+                    "ylabel": "Concentration (mmol/ml)", "stem": stem + "_" + reader.columns[c], "lines": []}
+                   for c in columns]
+        for point in reader.Points():
+            rows = reader.Read(point)
+            for f in range(len(columns)):
+                x, y = MinMaxDecimate(rows[:, 0], rows[:, columns[f]], bins, logx)
+                figures[f]["lines"].append(("point " + str(point + 1), x, y))
+    finally:
+        reader.Close()
+    return(figures)
+
+def Render(job):
+    """Draws one figure and writes it to file. 'job' is a (figure, filename, dpi, logx, logy) tuple.
+    Output: the file name."""
+    figure, filename, dpi, logx, logy = job
+    fig, ax = plt.subplots(figsize=FIGSIZE)
+    try:
+        for label, x, y in figure["lines"]:
+            ax.plot(x, y, label=label, linewidth=1)
+        ax.set_title(figure["title"])
+        ax.set_xlabel(figure["xlabel"])
+        ax.set_ylabel(figure["ylabel"])
+        if logx:
+            ax.set_xscale("log")
+        if logy:
+            ax.set_yscale("log")
+        else:
+            ax.ticklabel_format(style="sci", scilimits=(0, 1), axis="y")
+        # A legend is only readable for a few lines.
+        if len(figure["lines"]) <= 12:
+            ax.legend(fontsize="small")
+        fig.savefig(filename, dpi=dpi)
+    finally:
+        plt.close(fig)
+    return(filename)
+
+def main(args):
+    """Function to render figures for a whole batch of results without a display, in parallel.
+    Arguments: one or more results files, column store directories, trajectory store directories or quoted glob
+    patterns. Results files (Parsed files, column stores, Batch_output.txt) give dose-response figures, read as
+    CurveFit.py reads them; trajectory stores give time course figures with a line per sweep point.
+    Options: '--species' is a comma-separated list of species to plot. Default: every species. '--dose' names the
+    dose column, as for CurveFit.py. '--overlay' is models (default), a figure per species overlaying every model,
+    or species, a figure per model overlaying every species. '--format' is png (default) or svg. '--dpi' sets the
+    resolution. Default: 100. '--log' is x, y or xy for log axes. '--directory' is the output directory. Default:
+    Plots. '--workers' is the number of processes rendering figures. Default: 1.
+    Dense lines are decimated to the lowest & highest value in each pixel column before plotting.
+    """
+
+    # Options are separated from the positional arguments first.
+    patterns, options = SplitOptions(args)
+    species = options["species"].split(",") if "species" in options else None
+    dosename = options.get("dose")
+    overlay = options.get("overlay", "models")
+    fileformat = options.get("format", "png")
+    dpi = int(options.get("dpi", 100))
+    logx = "x" in options.get("log", "")
+    logy = "y" in options.get("log", "")
+    directory = options.get("directory", "Plots")
+    try:
+        workers = int(options["workers"])
+    except KeyError:
+        workers = 1
+
+    # Housekeeping.
+    assert overlay in ("models", "species")
+    assert fileformat in ("png", "svg")
+    assert workers >= 1
+    filenames = []
+    for pattern in patterns:
+        filenames = filenames + (sorted(glob.glob(pattern)) or [pattern])
+    filenames = [filename for filename in filenames if os.path.exists(filename)]
+    if not filenames:
+        sys.stderr.write("Error. No results files found.\n")
+        return 1
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # Figures are built, and their lines decimated once, here; only the drawing is spread over the workers.
+    # Trajectory lines are decimated as they are read.
+    bins = FIGSIZE[0] * dpi
+    stores = [filename for filename in filenames if os.path.isfile(os.path.join(filename, HEADER))]
+    results = [filename for filename in filenames if filename not in stores]
+    figures = []
+    if results:
+        try:
+            figures = ResponseFigures(results, dosename, species, overlay)
+        except ValueError as error:
+            sys.stderr.write("Error. " + str(error) + "\n")
+            return 1
+    for figure in figures:
+        figure["lines"] = [(label,) + MinMaxDecimate(x, y, bins, logx) for label, x, y in figure["lines"]]
+    for dirname in stores:
+        figures = figures + TrajectoryFigures(dirname, species, bins, logx)
+    jobs = [(figure, os.path.join(directory, _Name(figure["stem"]) + "." + fileformat), dpi, logx, logy)
+            for figure in figures]
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            written = pool.map(Render, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        written = [Render(job) for job in jobs]
+    print("{} figures written to {}.".format(len(written), directory))
+
+if (__name__ == '__main__'):
+    main(sys.argv[1:])
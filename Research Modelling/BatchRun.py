@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+from SweepTools import *
+import numpy as np
+import multiprocessing
+import itertools
+import glob
+import os
+import sys
+
+def main(args):
+    """Function to simulate every model matching a file pattern over one shared sweep, in a single run.
+    Arguments: 'pattern' is a glob pattern for the model files in XML (SBML) format, e.g. "Model Files/*.xml",
+    quoted so the shell does not expand it. 'duration' is the time course duration in seconds. Step count = duration
+    in seconds. All further arguments are sweep axes, as read by AxisParser; the sweep is every combination of axis
+    values, as for GridRun.py.
+    Options: '--engine', '--mode', '--settle', '--times', '--workers', '--cache', '--cache-size' as for
+    ConcentrationRun.py. Every (model, sweep point) pair is spread over the '--workers' processes. Default: one per
+    CPU.
+    Output: Batch_output.txt, one table for all models: model name, the axis values, then time & species concentrations.
+    Axis columns are named for their axis with '_set' added, e.g. inducer_1_set, so a swept species' value is not
+    confused with its concentration column. Columns are every species found in any model; species a model lacks are
+    written as nan.
+    Models missing a swept species or reaction parameter are skipped with a warning.
+    """
+
+    # Options are separated from the positional arguments first.
+    args, options = SplitOptions(args)
+    try:
+        workers = int(options["workers"])
+    except KeyError:
+        workers = multiprocessing.cpu_count()
+    mode = SweepMode(options)
+    settle = SettleOptions(options)
+    cache = CacheOption(options)
+
+    # 'args' is fed to the main function as a tuple. Defining variables & ensuring type is correct.
+    pattern = str(args[0])
+    duration = int(args[1])
+    axes = [AxisParser(spec) for spec in args[2:]]
+    filenames = sorted(glob.glob(pattern))
+
+    # Housekeeping.
+    assert isinstance(duration, int)
+    assert len(axes) > 0
+    assert workers >= 1
+    if not filenames:
+        sys.stderr.write("Error. No model files match " + pattern + "\n")
+        return 1
+    if mode == "stochastic":
+        sys.stderr.write("Error. BatchRun.py does not run --mode stochastic; use ConcentrationRun.py or GridRun.py.\n")
+        return 1
+
+    # Sweep points in C order, shared by every model: the last axis changes fastest.
+    sessionclass = EngineClass(options)
+    steps = TimeSteps(options, duration)
+    shape = tuple([len(axis[2]) for axis in axes])
+    points = []
+    values = []
+    for index in itertools.product(*[range(n) for n in shape]):
+        values.append([axes[a][2][index[a]] for a in range(len(axes))])
+        overrides = [axes[a][1](values[-1][a]) for a in range(len(axes))]
+        message = "Running {} {} simulation of {{}} at point {} of {}.".format(sessionclass.name, mode,
+                                                                           len(points) + 1, int(np.prod(shape)))
+        points.append((message, overrides))
+
+    # Each model is loaded once here to read its species. Applying the first point's changes checks that every axis
+    # exists in the model.
+    sessions = {}
+    speciesids = []
+    for filename in filenames:
+        session = sessionclass(filename, duration)
+        try:
+            ApplyOverrides(session, points[0][1])
+        except (AssertionError, KeyError, ValueError):
+            sys.stderr.write("Warning. Skipping " + filename + ": a swept species or parameter is not in the model.\n")
+            continue
+        sessions[filename] = session
+        speciesids = speciesids + [speciesid for speciesid in session.speciesids if speciesid not in speciesids]
+    filenames = [filename for filename in filenames if filename in sessions]
+    if not filenames:
+        sys.stderr.write("Error. No model has every swept species & parameter.\n")
+        return 1
+
+    try:
+        results = RunModels(sessionclass, filenames, duration, points, steps,
+                            SweepSettings(workers, mode, settle, cache=cache), sessions)
+    except SimulationError as error:
+        sys.stderr.write(str(error))
+        return 1
+
+    # Consolidated table. Each model's species are placed in the shared columns, nan elsewhere.
+    header = ["model"] + [axis[0] + "_set" for axis in axes] + ["time"] + speciesids
+    if settle is not None and mode == "time-course":
+        header.append("settling_time")
+    batchfilename = "Batch_output.txt"
+    with open(batchfilename, "w+") as bfn:
+        bfn.write(", ".join(header) + "\n")
+        for m in range(len(filenames)):
+            modelids = sessions[filenames[m]].speciesids
+            placing = [0] + [1 + speciesids.index(speciesid) for speciesid in modelids]
+            if settle is not None and mode == "time-course":
+                placing.append(len(speciesids) + 1)
+            modelname = os.path.basename(filenames[m])[:-4]
+            for n in range(len(points)):
+                for row in results[m][n]:
+                    line = np.empty(len(header) - 1 - len(axes))
+                    line.fill(np.nan)
+                    line[placing] = row
+                    bfn.write(" ".join([modelname] + [str(x) for x in values[n]] + [str(x) for x in line]) + "\n")
+    print("{} models x {} points written to {}.".format(len(filenames), len(points), batchfilename))
+
+if (__name__ == '__main__'):
+    main(sys.argv[1:])
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+from SweepTools import *
+from MassActionModel import MassActionModel
+import ConcentrationRun
+import ParameterRun
+import numpy as np
+import multiprocessing
+import itertools
+import platform
+import time
+import tempfile
+import shutil
+import json
+import glob
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak memory is then not reported.
+    resource = None
+
+# Phases reported for every scenario, in order. Time outside them is reported as "other".
+PHASES = ["model load", "report setup", "integration", "parsing", "file I/O"]
+
+def PeakMemory():
+    "Returns the peak resident memory of this process and its finished child processes in MB, or None."
+    if resource is None:
+        return(None)
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in kB on Linux and in bytes on Mac OS X.
+    if sys.platform == "darwin":
+        peak = peak / 1024.0
+    return(peak / 1024.0)
+
+def Scenarios(filenames, kinds, durations, counts, engines, modes, variants=([],)):
+    """Scenarios function. Builds every combination of model, sweep kind, duration, point count, engine, mode and
+    variant. Concentration sweeps vary the model's first inducer species from 0 to 0.01 mmol/ml. Parameter sweeps
+    vary its first reaction parameter from half to twice its value, with the inducer at the ParameterRun.py default.
+    'variants' lists the extra run script options of each variant, as argument lists, e.g. ["--workers", "4"].
+    Output: list of scenario dictionaries, each with the run script arguments in 'args'."""
+    scenarios = []
+    for filename in filenames:
+        network = MassActionModel(filename)
+        inducers = [speciesid for speciesid in network.speciesids if speciesid.startswith("inducer")]
+        parameters = [parameterid for parameterid in network.parameterids if "." in parameterid]
+        model = os.path.basename(filename)
+        for kind, duration, count, engine, mode, variant in itertools.product(kinds, durations, counts, engines,
+                                                                              modes, variants):
+            if not inducers or (kind == "parameter" and not parameters):
+                continue
+            if kind == "concentration":
+                args = [model, "0", "0.01", str(count), str(duration), inducers[0]]
+            else:
+                value = float(network.parametervalues[network.parameterindex[parameters[0]]])
+                reaction, parameter = parameters[0].split(".", 1)
+                args = [model, repr(value / 2), repr(value * 2), str(count), str(duration), reaction, parameter,
+                        inducers[0]]
+            name = "/".join([model[:-4], kind, engine, mode, "d" + str(duration), "n" + str(count)])
+            # Variants are named after their options, e.g. workers_4; scenarios without one keep their plain name.
+            if variant:
+                name = name + "/" + "_".join([arg.lstrip("-") for arg in variant])
+            scenarios.append({"name": name, "filename": filename, "model": model, "kind": kind, "engine": engine,
+                              "mode": mode, "duration": duration, "points": count, "options": " ".join(variant),
+                              "args": args + ["--engine", engine, "--mode", mode] + variant})
+    return(scenarios)
+
+def _RunScenario(queue, scenario, directory):
+    """Runs one scenario through its run script's main function in 'directory', in a fresh process, so that model
+    loads and peak memory are not shared between scenarios. Puts the measurements on 'queue'."""
+    os.chdir(directory)
+    sys.stdout = open(os.devnull, "w")
+    script = ConcentrationRun if scenario["kind"] == "concentration" else ParameterRun
+    phases.Reset()
+    start = time.time()
+    try:
+        status = "ok" if not script.main(scenario["args"]) else "failed"
+    except Exception as error:
+        status = "error: " + repr(error)
+    wall = time.time() - start
+    timings = dict((phase, phases.totals.get(phase, 0.0)) for phase in PHASES)
+    timings["other"] = max(0.0, wall - sum(timings.values()))
+    queue.put({"status": status, "wall_s": wall, "points_per_s": scenario["points"] / wall, "phases": timings,
+               "peak_memory_mb": PeakMemory()})
+
+def RunScenario(scenario, repeat):
+    """Runs a scenario 'repeat' times, each in a fresh process & scratch directory holding a copy of the model, and
+    keeps the fastest run. Output: the scenario dictionary with its measurements added."""
+    best = None
+    for r in range(repeat):
+        directory = tempfile.mkdtemp()
+        try:
+            shutil.copy(scenario["filename"], directory)
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_RunScenario, args=(queue, scenario, directory))
+            process.start()
+            process.join()
+            if process.exitcode != 0 or queue.empty():
+                measured = {"status": "crashed with exit code " + str(process.exitcode)}
+            else:
+                measured = queue.get()
+        finally:
+            shutil.rmtree(directory)
+        if best is None or measured.get("wall_s", float("inf")) < best.get("wall_s", float("inf")):
+            best = measured
+    result = dict((key, value) for key, value in scenario.items() if key not in ("filename", "args"))
+    result.update(best)
+    return(result)
+
+def Compare(results, baselinefilename, threshold):
+    """Prints the points per second of each scenario against a baseline benchmark file, flagging scenarios slower
+    by more than 'threshold' (a fraction). Output: number of regressions."""
+    with open(baselinefilename) as bfn:
+        baseline = dict((result["name"], result) for result in json.load(bfn)["scenarios"])
+    regressions = 0
+    print("{:<60} {:>12} {:>12} {:>8}".format("scenario", "baseline/s", "points/s", "ratio"))
+    for result in results:
+        old = baseline.get(result["name"])
+        if old is None or "points_per_s" not in old or "points_per_s" not in result:
+            continue
+        ratio = result["points_per_s"] / old["points_per_s"]
+        flag = ""
+        if ratio < 1 - threshold:
+            flag = "  REGRESSION"
+            regressions = regressions + 1
+        print("{:<60} {:>12.3f} {:>12.3f} {:>8.2f}{}".format(result["name"], old["points_per_s"],
+                                                            result["points_per_s"], ratio, flag))
+    return(regressions)
+
+def main(args):
+    """Function to benchmark the run scripts on standard sweep scenarios across the bundled models.
+    All arguments are options. '--models' is a glob pattern of models. Default: all of Model Files/*.xml.
+    '--kinds' is a comma-separated list of sweep kinds, concentration and/or parameter. Default: both.
+    '--durations' & '--points' are comma-separated lists of time course durations and sweep point counts.
+    Defaults: 5000,50000 and 10,50. '--engines' & '--modes' are comma-separated lists of engines (copasi, numpy,
+    batch) and modes (time-course, steady-state) to compare. Defaults: copasi and time-course. '--variants' is a
+    semicolon-separated list of extra run script options to compare, each variant written as on the command line,
+    e.g. "none;--workers 4;--settle 100;--format columns;--warm-start"; 'none' adds no options. A relative '--cache'
+    directory starts empty in each scenario's scratch directory. Default: none. '--repeat' runs each
+    scenario that many times, keeping the fastest. Default: 1. '--json' names the results file. Default:
+    Benchmark_output.json. '--compare' is an earlier results file to compare points per second against; scenarios
+    slower by more than '--threshold' (default 0.1) are flagged as regressions.
+    """
+
+    # Options are separated from the positional arguments first.
+    args, options = SplitOptions(args)
+    here = os.path.dirname(os.path.abspath(__file__))
+    pattern = options.get("models", os.path.join(here, "Model Files", "*.xml"))
+    kinds = options.get("kinds", "concentration,parameter").split(",")
+    durations = [int(x) for x in options.get("durations", "5000,50000").split(",")]
+    counts = [int(x) for x in options.get("points", "10,50").split(",")]
+    engines = options.get("engines", "copasi").split(",")
+    modes = options.get("modes", "time-course").split(",")
+    variants = [[] if variant.strip() == "none" else variant.split() for variant in
+                options.get("variants", "none").split(";")]
+    repeat = int(options.get("repeat", 1))
+    jsonfilename = options.get("json", "Benchmark_output.json")
+    threshold = float(options.get("threshold", 0.1))
+
+    # Housekeeping.
+    assert repeat >= 1
+    for kind in kinds:
+        assert kind in ("concentration", "parameter")
+    filenames = sorted(glob.glob(pattern))
+    if not filenames:
+        sys.stderr.write("Error. No model files match " + pattern + "\n")
+        return 1
+
+    scenarios = Scenarios(filenames, kinds, durations, counts, engines, modes, variants)
+    results = []
+    for n in range(len(scenarios)):
+        result = RunScenario(scenarios[n], repeat)
+        results.append(result)
+        if result["status"] == "ok":
+            print("{} of {}: {} {:.3f} points/s".format(n + 1, len(scenarios), result["name"],
+                                                       result["points_per_s"]))
+        else:
+            print("{} of {}: {} {}".format(n + 1, len(scenarios), result["name"], result["status"]))
+
+    # Machine-readable results, with enough about the machine to tell runs apart.
+    output = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+              "platform": platform.platform(), "numpy": np.__version__, "phases": PHASES + ["other"],
+              "scenarios": results}
+    with open(jsonfilename, "w+") as jfn:
+        json.dump(output, jfn, indent=1, sort_keys=True)
+    print("{} scenarios written to {}.".format(len(results), jsonfilename))
+
+    if "compare" in options:
+        regressions = Compare(results, options["compare"], threshold)
+        print("{} regressions beyond {:.0%}.".format(regressions, threshold))
+
+if (__name__ == '__main__'):
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+from SweepTools import SimulationError
+from ResultCache import _Canonical, _Replace
+import numpy as np
+import hashlib
+import json
+import os
+import sys
+
+class CheckpointError(Exception):
+    "Raised when a checkpoint to resume from belongs to a different sweep."
+    pass
+
+def SweepKey(sessionclass, sessionargs, setup, points, steps, settings):
+    """Returns a hash of everything that determines a sweep's results, as for a ResultCache key, so a checkpoint is
+    only resumed by the same sweep. 'settings' is the sweep's SweepSettings."""
+    with open(sessionargs[0], "rb") as mfn:
+        parts = [hashlib.sha1(mfn.read()).hexdigest()]
+    parts = parts + [sessionclass.name, sessionclass.solver, list(sessionargs[1:]), list(setup),
+                     [point[1] for point in points], list(steps), settings.mode, settings.settle, settings.ensemble,
+                     settings.warm]
+    return(hashlib.sha1(_Canonical(parts).encode("utf-8")).hexdigest())
+
+class Checkpoint(object):
+    """Append-only record of the points of a sweep as they finish, so an interrupted sweep can be resumed.
+    The file holds one JSON line per point: its number in sweep order and either its rows, with the final state row
+    of a warm-started point, or, for a failed point, the error message text. The first line holds the sweep key.
+    Arguments: 'filename' is the checkpoint file. 'key' is the SweepKey of the sweep. 'resume' reads the points
+    already recorded in the file; otherwise it is started afresh. Resuming a checkpoint of another sweep raises
+    CheckpointError, leaving the file as it was."""
+
+    def __init__(self, filename, key, resume=False):
+        self.filename = filename
+        self.resume = resume
+        self.results = {}
+        self.finals = {}
+        self.failures = {}
+        entries = []
+        if resume and os.path.exists(filename):
+            with open(filename) as cfn:
+                lines = cfn.readlines()
+            if not lines or json.loads(lines[0]).get("sweep") != key:
+                raise CheckpointError("Checkpoint " + filename + " is from a different sweep.")
+            for line in lines[1:]:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # A partly written last line, from an interrupted run.
+                    continue
+        # The entries read are written to a new file that then replaces the old one, so that an interrupted last line
+        # is dropped without the recorded points being at risk if this run is interrupted too.
+        self.file = open(filename + ".tmp", "w")
+        self.file.write(json.dumps({"sweep": key}) + "\n")
+        for entry in entries:
+            self.Record(entry)
+        self.file.close()
+        _Replace(filename + ".tmp", filename)
+        self.file = open(filename, "a")
+
+    def Record(self, entry):
+        "Appends one point's entry to the file and to the points held."
+        if "rows" in entry:
+            self.results[entry["point"]] = np.array(entry["rows"], dtype=float)
+            if "final" in entry:
+                self.finals[entry["point"]] = np.array(entry["final"], dtype=float)
+            self.failures.pop(entry["point"], None)
+        else:
+            self.failures[entry["point"]] = entry["error"]
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+
+    def Write(self, point, rows, final=None):
+        "Records a finished point: its rows & final state row, if given, or the SimulationError it failed with."
+        if isinstance(rows, SimulationError):
+            self.Record({"point": point, "error": str(rows)})
+        elif final is None:
+            self.Record({"point": point, "rows": np.asarray(rows).tolist()})
+        else:
+            self.Record({"point": point, "rows": np.asarray(rows).tolist(), "final": np.asarray(final).tolist()})
+
+    def Pending(self, count, warm=False):
+        """Returns the numbers of the points of a sweep of 'count' points still to run, and the final state row of the
+        point before the first of them, or None. Continuation ('warm') reruns every point from the first one missing,
+        starting from the final state of the point before it."""
+        todo = [n for n in range(count) if n not in self.results]
+        previous = None
+        if warm and todo:
+            todo = list(range(todo[0], count))
+            previous = self.finals.get(todo[0] - 1)
+        if self.resume:
+            print("{} of {} sweep points found in the checkpoint.".format(count - len(todo), count))
+        return((todo, previous))
+
+    def Done(self, point, rows, final=None):
+        "Records a finished point as Write does, warning that it is skipped if it failed."
+        if isinstance(rows, SimulationError):
+            sys.stderr.write("Warning. Sweep point {} failed and is skipped.\n{}".format(point + 1, str(rows)))
+        self.Write(point, rows, final)
+
+    def Finish(self, results):
+        """Closes the checkpoint once the sweep's 'results' are all in. It is removed if no point failed; otherwise it
+        is kept, with a warning, for a rerun with --resume."""
+        failures = [n for n in range(len(results)) if isinstance(results[n], SimulationError)]
+        if failures:
+            sys.stderr.write("Warning. {} of {} sweep points failed; their rows are nan. Their errors are kept in {}; "
+                             "rerun with --resume to retry them.\n".format(len(failures), len(results),
+                                                                          self.filename))
+        self.Close(remove=not failures)
+
+    def Close(self, remove=False):
+        "Closes the file, removing it if 'remove' is set, e.g. once the sweep has finished without failures."
+        self.file.close()
+        if remove:
+            os.remove(self.filename)
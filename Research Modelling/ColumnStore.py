@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+import numpy as np
+import json
+import os
+
+# Index file of a column store, listing the columns in order with the run metadata.
+INDEX = "columns.json"
+
+def CheckNames(names):
+    "Raises ValueError if a column name is repeated, as the columns could not be told apart when read back by name."
+    repeated = sorted(set([name for name in names if list(names).count(name) > 1]))
+    if repeated:
+        raise ValueError("Repeated column names: " + ", ".join(repeated))
+
+def WriteColumns(dirname, names, data, metadata):
+    """WriteColumns function. Writes results as a typed binary columnar store: a directory with one .npy file of
+    float64 values per column, plus an index of the column names, the sweep axis and run metadata.
+    Arguments: 'dirname' is the store directory, created if needed. 'names' lists the column names. 'data' is an
+    array of rows, one column per name. 'metadata' is a dictionary of run settings; its 'axis' entry names the
+    column holding the sweep values. Column names must be unique."""
+    CheckNames(names)
+    data = np.asarray(data, dtype=float).reshape(-1, len(names))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    files = []
+    for c in range(len(names)):
+        # Column files are numbered, so that any species name makes a valid file name.
+        files.append(str(c) + ".npy")
+        np.save(os.path.join(dirname, files[c]), np.ascontiguousarray(data[:, c]))
+    with open(os.path.join(dirname, INDEX), "w+") as ifn:
+        json.dump({"columns": list(names), "files": files, "rows": data.shape[0], "metadata": metadata}, ifn,
+                  indent=1)
+
+def ReadIndex(dirname):
+    "Returns the index of a column store: column names, their files, the row count and the run metadata."
+    with open(os.path.join(dirname, INDEX)) as ifn:
+        return(json.load(ifn))
+
+def ReadColumns(dirname, names=None):
+    """ReadColumns function. Opens columns of a store through memory mapping, so only the columns asked for, and
+    only the parts of them used, are read from disk. Arguments: 'dirname' is the store directory. 'names' lists the
+    columns wanted. Default: all. Output: dictionary of column name to read-only array."""
+    index = ReadIndex(dirname)
+    if names is None:
+        names = index["columns"]
+    columns = {}
+    for name in names:
+        path = os.path.join(dirname, index["files"][index["columns"].index(name)])
+        columns[name] = np.load(path, mmap_mode="r")
+    return(columns)
+
+def IsColumnStore(filename):
+    "Returns True if 'filename' is a column store directory rather than a text results file."
+    return(os.path.isfile(os.path.join(filename, INDEX)))
+
+def ReadResults(filename):
+    """ReadResults function. Reads a results file of the run scripts into numeric columns, whichever its format: a
+    column store, a parsed text file, whose first unnamed column becomes "iteration" for ConcentrationRun.py or
+    "parameter" for ParameterRun.py (file names ending _p_output.txt), or Batch_output.txt, whose "model" column is read
+    as text. Files with a repeated column name raise ValueError. Output: tuple of the column names, a dictionary of
+    column name to array, and the run metadata, whose 'axis' entry names the sweep axis column."""
+    if IsColumnStore(filename):
+        index = ReadIndex(filename)
+        return((index["columns"], ReadColumns(filename), index["metadata"]))
+    with open(filename) as rfn:
+        header = rfn.readline().strip().split(", ")
+    if header[0] == "model":
+        names = header
+        data = np.loadtxt(filename, skiprows=1, usecols=range(1, len(names)), ndmin=2)
+        models = np.loadtxt(filename, skiprows=1, usecols=(0,), dtype=str, ndmin=1)
+        axis = names[1]
+    else:
+        axis = "parameter" if filename.endswith("_p_output.txt") else "iteration"
+        names = [axis] + header
+        data = np.loadtxt(filename, skiprows=1, ndmin=2)
+        models = None
+    CheckNames(names)
+    offset = len(names) - data.shape[1]
+    columns = dict((names[c], data[:, c - offset]) for c in range(offset, len(names)))
+    if models is not None:
+        columns["model"] = models
+    return((names, columns, {"axis": axis}))
@@ -2,16 +2,18 @@
 
 # Author: Adam Bannister, Newcastle University.
 
+from ColumnStore import IsColumnStore, ReadColumns
 import matplotlib.pyplot as plt
 import sys
 
 def main(args):
     # Empty lists defined for later appending.
     """Plots input/output concentration curve of a parsed file from ModelScript4.py. Arguments:
-    'filename' is name of the parsed .txt file.
+    'filename' is name of the parsed .txt file, or of a column store directory written with '--format columns'.
     'inputname' is the name of the input/inducer species in the model results.
     'outputname' is the name of the output/reporter in the mode results.
-    'logxYN' is an optional argument which specifies whether the X axis scale should be logarithmic. Default N (no)."""
+    'logxYN' is an optional argument which specifies whether the X axis scale should be logarithmic. Default N (no).
+    'savefile' is an optional .png or .svg file name; it is written to instead of a plot window."""
     inputlst = []
     outputlst = []
     filename = str(args[0])
@@ -21,32 +23,36 @@ def main(args):
         logxYN = str(args[3])
     except IndexError:
         logxYN = "N"
+    try:
+        savefile = str(args[4])
+    except IndexError:
+        savefile = None
+    if savefile is not None:
+        # Saving needs no display, so a headless backend is used.
+        plt.switch_backend("Agg")
 
-    inputlocation = 0
-    outputlocation = 0
-
-    with open(filename, "r+") as ipf:
-        for n in range(len(ipf.readlines())-1):
-            if n == 0:
-                ipf.seek(0)
-                checkline = ipf.readline()
-                checkline = checkline.strip()
-                checkline = checkline.replace(",","")
-                checkline = checkline.split()
-                print checkline
-                for i in range(len(checkline)):
-                    if str(checkline[i]) == inputname:
-                        inputlocation = inputlocation + i
-                    elif str(checkline[i]) == outputname:
-                        outputlocation = outputlocation + i
-            inputline = ipf.readline()
-            iterline = inputline.strip(",")
-            iterline = iterline.strip()
-            splitline = iterline.split()
-            inputstr = splitline[inputlocation+1]
-            outputstr = splitline[outputlocation+1]
-            inputlst.append(inputstr)
-            outputlst.append(outputstr)
+    if IsColumnStore(filename):
+        # Binary column store from the run scripts' '--format columns': only the two columns plotted are read.
+        columns = ReadColumns(filename, [inputname, outputname])
+        inputlst = columns[inputname]
+        outputlst = columns[outputname]
+    else:
+        # The file is read once: a header line of column names, then one line per row, led by the iteration number.
+        with open(filename, "r") as ipf:
+            lines = ipf.readlines()
+        checkline = lines[0].strip().replace(",", "").split()
+        for name in (inputname, outputname):
+            if name not in checkline:
+                sys.stderr.write("Error. No column " + name + " in " + filename + "\n")
+                return 1
+        inputlocation = checkline.index(inputname)
+        outputlocation = checkline.index(outputname)
+        for inputline in lines[1:]:
+            splitline = inputline.strip(",").strip().split()
+            if not splitline:
+                continue
+            inputlst.append(float(splitline[inputlocation+1]))
+            outputlst.append(float(splitline[outputlocation+1]))
     fig, ax = plt.subplots()
     ax.set_xlabel("Input concentration (mmol/ml)")
     ax.set_ylabel("Output concentration (mmol/ml)")
@@ -54,6 +60,10 @@ def main(args):
     if logxYN == "Y":
         plt.xscale("log")
     plt.plot(inputlst, outputlst)
-    plt.show()
+    if savefile is not None:
+        plt.savefig(savefile)
+        plt.close(fig)
+    else:
+        plt.show()
 if (__name__ == '__main__'):
     main(sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,230 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+from COPASI import *
+from SweepTools import SimulationError, TimeSeriesRows, SettledSince, phases
+import numpy as np
+
+class CopasiSession(object):
+    """Holds one COPASI datamodel loaded from an SBML file, with its time course report & task set up once, so that
+    many sweep points can be simulated against a single model load.
+    Arguments: 'filename' is the model file in XML (SBML) format. 'duration' is the time course duration in seconds;
+    step count = duration in seconds."""
+
+    name = "COPASI"
+    solver = "LSODA rtol=1e-6 atol=1e-12"
+
+    def __init__(self, filename, duration):
+        # Housekeeping COPASI functionality, as found in Python-COPASI examples.
+        assert CCopasiRootContainer.getRoot() != None
+        self.duration = duration
+        self.dataModel = CCopasiRootContainer.addDatamodel()
+        # Importing from file, SBML format.
+        with phases.Phase("model load"):
+            self.dataModel.importSBML(filename)
+            self.model = self.dataModel.getModel()
+        with phases.Phase("report setup"):
+            self.SetupTasks(duration)
+
+    def SetupTasks(self, duration):
+        "Creates the time course report and sets up the Time-Course & Steady-State tasks, once per model load."
+        # Creating a report to display/output timecourse results.
+        # Code here taken from Python-COPASI package Example1.py.
+        reports = self.dataModel.getReportDefinitionList()
+        self.report = reports.createReportDefinition("Report", "Time course output")
+        self.report.setTaskType(CTaskEnum.timeCourse)
+        self.report.setIsTable(False)
+        self.report.setSeparator(CCopasiReportSeparator(", "))
+        header = self.report.getHeaderAddr()
+        body = self.report.getBodyAddr()
+        body.push_back(CRegisteredObjectName(
+            CCopasiObjectName(self.model.getCN().getString() + ",Reference=Time").getString()))
+        body.push_back(CRegisteredObjectName(self.report.getSeparator().getCN().getString()))
+        header.push_back(CRegisteredObjectName(CCopasiStaticString("time").getCN().getString()))
+        header.push_back(CRegisteredObjectName(self.report.getSeparator().getCN().getString()))
+        iMax = self.model.getMetabolites().size()
+        # Metabolites are kept by index: getMetabolite looks a string up by object name, which need not be the SBML id.
+        self.speciesids = []
+        self.metabs = []
+        for i in range(0, iMax):
+            metab = self.model.getMetabolite(i)
+            assert metab != None
+            self.speciesids.append(metab.getSBMLId())
+            self.metabs.append(metab)
+            body.push_back(CRegisteredObjectName(
+                metab.getObject(CCopasiObjectName("Reference=Concentration")).getCN().getString()))
+            header.push_back(CRegisteredObjectName(CCopasiStaticString(metab.getSBMLId()).getCN().getString()))
+            if (i != iMax - 1):
+                body.push_back(CRegisteredObjectName(self.report.getSeparator().getCN().getString()))
+                header.push_back(CRegisteredObjectName(self.report.getSeparator().getCN().getString()))
+
+        # Time course with one step per second. Method is deterministic (LSODA).
+        # Code adapted from Python-COPASI package - COPASI v4.19 - example scripts.
+        self.trajectoryTask = self.dataModel.getTask("Time-Course")
+        self.trajectoryTask.setMethodType(CTaskEnum.deterministic)
+        self.trajectoryTask.getProblem().setModel(self.model)
+        self.trajectoryTask.setScheduled(True)
+        self.trajectoryTask.getReport().setReportDefinition(self.report)
+        self.trajectoryTask.getReport().setAppend(False)
+        problem = self.trajectoryTask.getProblem()
+        problem.setStepNumber(duration)
+        self.model.setInitialTime(0.0)
+        problem.setDuration(duration)
+        problem.setTimeSeriesRequested(True)
+        # LSODA parameters being set are the same as the default within the COPASI UI.
+        method = self.trajectoryTask.getMethod()
+        parameter = method.getParameter("Absolute Tolerance")
+        assert parameter != None
+        assert parameter.getType() == CCopasiParameter.UDOUBLE
+        parameter.setValue(1.0e-12)
+
+        # Steady-state task. Newton's method, falling back to COPASI's own forward integration when Newton fails.
+        self.steadyStateTask = self.dataModel.getTask("Steady-State")
+        self.steadyStateTask.getProblem().setModel(self.model)
+        self.steadyStateTask.setScheduled(True)
+        self.steadyStateTask.getProblem().setJacobianRequested(False)
+        self.steadyStateTask.getProblem().setStabilityAnalysisRequested(False)
+        method = self.steadyStateTask.getMethod()
+        for name in ("Use Newton", "Use Integration"):
+            parameter = method.getParameter(name)
+            assert parameter != None
+            parameter.setValue(True)
+
+    def SetSpecies(self, speciesname, value):
+        "Sets the initial concentration of a species, by SBML id or object name, in mmol/ml."
+        if speciesname in self.speciesids:
+            species = self.metabs[self.speciesids.index(speciesname)]
+        else:
+            species = self.model.getMetabolite(str(speciesname))
+        assert species is not None
+        species.setInitialConcentration(value)
+        changedObjects = ObjectStdVector()
+        changedObjects.push_back(species.getInitialConcentrationReference())
+        self.model.updateInitialValues(changedObjects)
+        self.model.compileIfNecessary()
+
+    def SetParameter(self, reactionname, parametername, value):
+        "Sets the value of a named parameter of a reaction."
+        reaction = self.model.getReaction(str(reactionname))
+        assert reaction is not None
+        reaction.setParameterValue(parametername, value)
+        changedObjects = ObjectStdVector()
+        changedObjects.push_back(reaction.getDataObject())
+        self.model.updateInitialValues(changedObjects)
+        self.model.compileIfNecessary()
+
+    def GetTolerances(self):
+        "Returns the LSODA relative & absolute tolerances of the time course."
+        method = self.trajectoryTask.getMethod()
+        return((method.getParameter("Relative Tolerance").getDblValue(),
+                method.getParameter("Absolute Tolerance").getDblValue()))
+
+    def SetTolerances(self, rtol, atol):
+        "Sets the LSODA relative & absolute tolerances of the time course."
+        method = self.trajectoryTask.getMethod()
+        method.getParameter("Relative Tolerance").setValue(rtol)
+        method.getParameter("Absolute Tolerance").setValue(atol)
+
+    def GetState(self):
+        "Returns the initial concentrations of all species, in report order."
+        state = [metab.getInitialConcentration() for metab in self.metabs]
+        return(np.array(state))
+
+    def SetState(self, state):
+        "Sets the initial concentrations of all species, in report order, e.g. from the final row of another run."
+        changedObjects = ObjectStdVector()
+        for c in range(len(self.metabs)):
+            metab = self.metabs[c]
+            metab.setInitialConcentration(float(state[c]))
+            changedObjects.push_back(metab.getInitialConcentrationReference())
+        self.model.updateInitialValues(changedObjects)
+        self.model.compileIfNecessary()
+
+    def Run(self, steps, target=""):
+        """Runs the time course from the current initial values. Arguments: 'steps' lists the step numbers to keep.
+        'target' is the paging file for the COPASI report; an empty target stops COPASI writing it.
+        Output: array of kept rows, time followed by species concentrations in report order."""
+        self.trajectoryTask.getReport().setTarget(target)
+        result = True
+        try:
+            with phases.Phase("integration"):
+                phases.Count("integrations")
+                result = self.trajectoryTask.process(True)
+        except:
+            result = False
+        if result == False:
+            message = "Error. Running the time course simulation failed.\n"
+            if CCopasiMessage.size() > 0:
+                message = message + CCopasiMessage.getAllMessageText(True)
+            raise SimulationError(message)
+        timeSeries = self.trajectoryTask.getTimeSeries()
+        # RecordedSteps are 1 + duration to account for initial state.
+        assert timeSeries.getRecordedSteps() == (self.duration+1)
+        with phases.Phase("parsing"):
+            return(TimeSeriesRows(timeSeries, self.dataModel, self.speciesids, steps))
+
+    def RunSettled(self, window, rtol, atol):
+        """Runs the time course in segments of 'window' seconds, each starting from the end of the last, and stops
+        once a segment shows every species within rtol * |concentration| + atol of its state at the full duration,
+        as SettledSince estimates it, or at the full duration. Output: array with one row, laid out as for Run, with
+        the settling time appended: the start of the quiet segment, or nan if the time course never settled."""
+        initial = self.GetState()
+        problem = self.trajectoryTask.getProblem()
+        self.trajectoryTask.getReport().setTarget("")
+        elapsed = 0
+        settled = float("nan")
+        try:
+            while elapsed < self.duration:
+                segment = min(window, self.duration - elapsed)
+                problem.setStepNumber(segment)
+                problem.setDuration(segment)
+                self.model.setInitialTime(float(elapsed))
+                result = True
+                try:
+                    with phases.Phase("integration"):
+                        phases.Count("integrations")
+                        result = self.trajectoryTask.process(True)
+                except:
+                    result = False
+                if result == False:
+                    message = "Error. Running the time course simulation failed.\n"
+                    if CCopasiMessage.size() > 0:
+                        message = message + CCopasiMessage.getAllMessageText(True)
+                    raise SimulationError(message)
+                with phases.Phase("parsing"):
+                    rows = TimeSeriesRows(self.trajectoryTask.getTimeSeries(), self.dataModel, self.speciesids,
+                                          range(segment+1))
+                elapsed = elapsed + segment
+                # The last segment ends the time course anyway, so only a segment with time left after it can settle.
+                left = self.duration - elapsed
+                if segment == window and left > 0 and SettledSince(rows, rtol, atol, left):
+                    settled = rows[0, 0]
+                    break
+                # The next segment starts from the final state of this one.
+                self.SetState(rows[-1, 1:])
+        finally:
+            # Restoring the initial state & time course settings for the next sweep point.
+            self.SetState(initial)
+            self.model.setInitialTime(0.0)
+            problem.setStepNumber(self.duration)
+            problem.setDuration(self.duration)
+        return(np.array([list(rows[-1]) + [settled]]))
+
+    def RunSteadyState(self):
+        """Runs the steady-state task from the current initial values. If no steady state is found, the full time
+        course is run instead and its final state kept. Output: array with one row, laid out as for Run. The time
+        of a converged steady state is recorded as inf."""
+        result = True
+        try:
+            with phases.Phase("integration"):
+                phases.Count("steady-state solves")
+                result = self.steadyStateTask.process(True)
+        except:
+            result = False
+        if result == False or self.steadyStateTask.getResult() == CSteadyStateMethod.notFound:
+            return(self.Run([self.duration]))
+        row = [float("inf")]
+        for metab in self.metabs:
+            row.append(metab.getConcentration())
+        return(np.array([row]))
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+from ColumnStore import ReadResults
+from SweepTools import SplitOptions
+import numpy as np
+import glob
+import os
+import re
+import sys
+
+# Columns that are not output species: time, settling time and the ensemble statistics of --mode stochastic.
+NOTSPECIES = re.compile(r"^(time|settling_time)$|_(var|q[0-9.eE+-]+)$")
+
+def FinalRows(axis, time):
+    """Returns the index of the last kept row of each sweep point. A point's rows share its axis value and run
+    forward in time, so a point ends where the axis value changes or time does not increase."""
+    ends = np.ones(len(axis), dtype=bool)
+    if len(axis) > 1:
+        ends[:-1] = (axis[1:] != axis[:-1]) | (time[1:] <= time[:-1])
+    return(np.nonzero(ends)[0])
+
+def Curves(filenames, dosename, outputnames):
+    """Reads every results file and cuts it into dose-response curves, one per model and output species, from the
+    last kept row of each sweep point. The dose is the 'dosename' column if given, else the sweep axis, except for
+    concentration sweeps, whose axis holds iteration numbers: there it is the swept species' column, as recorded in
+    a column store's metadata. Parsed text files do not record it, so need 'dosename'. A missing dose column raises
+    ValueError. Output: list of (model, species, doses, responses) tuples."""
+    curves = []
+    for filename in filenames:
+        names, columns, metadata = ReadResults(filename)
+        axis = metadata["axis"]
+        dose = dosename
+        if dose is None:
+            dose = metadata.get("species") if axis == "iteration" else axis
+        if dose is None:
+            raise ValueError(filename + " does not record the swept species; name the dose column with --dose.")
+        if dose not in columns:
+            raise ValueError(filename + " has no dose column " + dose + ".")
+        species = outputnames or [name for name in names[1:] if name != "model" and name != axis and
+                                  name != dose and not NOTSPECIES.search(name)]
+        if "model" in columns:
+            models = columns["model"]
+            labels = models[np.sort(np.unique(models, return_index=True)[1])]
+        else:
+            models = None
+            labels = [os.path.basename(filename).replace("Parsed_", "", 1).split("_output")[0]]
+        for label in labels:
+            rows = np.arange(len(columns[axis])) if models is None else np.nonzero(models == label)[0]
+            rows = rows[FinalRows(np.asarray(columns[axis])[rows], np.asarray(columns["time"])[rows])]
+            doses = np.asarray(columns[dose], dtype=float)[rows]
+            for name in species:
+                if name in columns:
+                    curves.append((label, name, doses, np.asarray(columns[name], dtype=float)[rows]))
+    return(curves)
+
+def FitSigmoids(x, y, mask, logistic=False, iterations=200):
+    """FitSigmoids function. Fits y = bottom + (top - bottom) / (1 + exp(-n (g(x) - c))) to many curves at once by
+    Levenberg-Marquardt least squares, every curve's step solved together with numpy. g(x) is log(x) for a Hill
+    curve, so that exp(c) is the EC50 and n the Hill coefficient, or x for a logistic curve, with midpoint c.
+    Arguments: 'x', 'y' & 'mask' are curves x points arrays; 'mask' marks the points to fit, so curves of different
+    lengths are padded. Output: tuple of the parameters (bottom, top, c, n) as a curves x 4 array and the R squared
+    of each fit."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        g = x if logistic else np.log(x)
+    usable = mask & ~np.isnan(y) & ~np.isnan(g) & (np.isfinite(g) | (g < 0))
+    weights = usable.astype(float)
+    y = np.where(usable, y, 0.0)
+    # Responses are fitted in units of each curve's largest value, so one damping rule suits every curve.
+    scale = np.max(np.abs(y), axis=1)
+    scale[scale == 0] = 1.0
+    y = y / scale[:, np.newaxis]
+    finite = usable & np.isfinite(g)
+    low = np.where(finite, g, np.inf).min(axis=1)
+    high = np.where(finite, g, -np.inf).max(axis=1)
+    span = np.where(high > low, high - low, 1.0)
+    first = np.argmin(np.where(usable, g, np.inf), axis=1)
+    last = np.argmax(np.where(usable, g, -np.inf), axis=1)
+    curves = np.arange(len(y))
+    bottom, top = y[curves, first], y[curves, last]
+    # The midpoint starts where the response is closest to half way, the slope at one decade or span per 4 units.
+    halfway = np.abs(y - (bottom + top)[:, np.newaxis] / 2.0) + np.where(finite, 0.0, np.inf)
+    middle = g[curves, np.argmin(halfway, axis=1)]
+    middle = np.where(np.isfinite(middle), middle, (low + high) / 2.0)
+    slope = np.ones(len(y)) if not logistic else 4.0 / span
+    parameters = np.vstack((bottom, top, middle, slope)).T
+    damping = np.ones(len(y)) * 1.0e-3
+
+    def Model(parameters):
+        bottom, top, middle, slope = [parameters[:, k, np.newaxis] for k in range(4)]
+        with np.errstate(over="ignore", invalid="ignore"):
+            u = 1.0 / (1.0 + np.exp(np.clip(-slope * (g - middle), -500.0, 500.0)))
+        u = np.where(np.isnan(u), 0.0, u)
+        return(bottom + (top - bottom) * u, u)
+
+    def Cost(parameters):
+        return(np.sum(weights * (Model(parameters)[0] - y) ** 2, axis=1))
+
+    cost = Cost(parameters)
+    for i in range(iterations):
+        fitted, u = Model(parameters)
+        bottom, top, middle, slope = [parameters[:, k, np.newaxis] for k in range(4)]
+        shape = (top - bottom) * u * (1.0 - u)
+        with np.errstate(invalid="ignore"):
+            jacobian = np.stack((1.0 - u, u, -slope * shape, np.where(np.isfinite(g), shape * (g - middle), 0.0)),
+                                axis=2) * weights[:, :, np.newaxis]
+        residuals = (fitted - y) * weights
+        normal = np.einsum("cpi,cpj->cij", jacobian, jacobian)
+        gradient = np.einsum("cpi,cp->ci", jacobian, residuals)
+        diagonal = np.einsum("cii->ci", normal)
+        damped = normal + (damping[:, np.newaxis, np.newaxis] * (diagonal[:, :, np.newaxis] + 1.0e-12) *
+                           np.eye(4)[np.newaxis])
+        step = np.linalg.solve(damped, -gradient[:, :, np.newaxis])[:, :, 0]
+        trial = parameters + step
+        trialcost = Cost(trial)
+        better = trialcost < cost
+        # A curve has converged once its steps no longer lower the cost, or only by a negligible fraction.
+        converged = (better & (cost - trialcost <= 1.0e-12 * cost)) | (damping >= 1.0e10)
+        parameters[better] = trial[better]
+        cost[better] = trialcost[better]
+        damping = np.where(better, damping / 3.0, damping * 2.0)
+        damping = np.clip(damping, 1.0e-12, 1.0e12)
+        if np.all(converged):
+            break
+    mean = np.sum(weights * y, axis=1) / np.maximum(weights.sum(axis=1), 1.0)
+    total = np.sum(weights * (y - mean[:, np.newaxis]) ** 2, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsquared = 1.0 - cost / total
+    parameters[:, 0] = parameters[:, 0] * scale
+    parameters[:, 1] = parameters[:, 1] * scale
+    # Curves with fewer points than parameters cannot be fitted. Flat curves keep their level, but have no midpoint
+    # or slope.
+    unfitted = usable.sum(axis=1) < 4
+    flat = total <= 1.0e-12 * weights.sum(axis=1)
+    parameters[unfitted] = np.nan
+    parameters[flat, 2:] = np.nan
+    rsquared[unfitted | flat] = np.nan
+    return((parameters, rsquared))
+
+def main(args):
+    """Function to fit dose-response curves to the results of ConcentrationRun.py, ParameterRun.py or BatchRun.py,
+    for every output species and every model at once, and tabulate their summary metrics.
+    Arguments: one or more results files or glob patterns: parsed text files, column store directories, or
+    Batch_output.txt, whose models are fitted separately.
+    Options: '--model' is hill (default) or logistic. '--dose' names the dose column. Default: the sweep axis, or
+    for concentration sweeps the swept species recorded in a column store; parsed text files of concentration sweeps
+    need it. '--outputs' is a comma-separated list of output species. Default: every species. '--output' names the
+    table. Default: CurveFit_output.txt.
+    Output: one row per model & output species: EC50 (logistic midpoint), Hill coefficient (logistic slope),
+    leakiness (fitted output with no input), maximum (fitted output at full input), dynamic range (maximum over
+    leakiness) and R squared.
+    """
+
+    # Options are separated from the positional arguments first.
+    patterns, options = SplitOptions(args)
+    shape = options.get("model", "hill")
+    dosename = options.get("dose")
+    outputnames = options["outputs"].split(",") if "outputs" in options else None
+    fitfilename = options.get("output", "CurveFit_output.txt")
+
+    # Housekeeping.
+    assert shape in ("hill", "logistic")
+    filenames = []
+    for pattern in patterns:
+        filenames = filenames + (sorted(glob.glob(pattern)) or [pattern])
+    filenames = [filename for filename in filenames if os.path.exists(filename)]
+    if not filenames:
+        sys.stderr.write("Error. No results files found.\n")
+        return 1
+
+    try:
+        curves = Curves(filenames, dosename, outputnames)
+    except ValueError as error:
+        sys.stderr.write("Error. " + str(error) + "\n")
+        return 1
+    if not curves:
+        sys.stderr.write("Error. No curves to fit.\n")
+        return 1
+
+    # Curves are padded to the longest, so all are fitted as one array.
+    length = max([len(curve[2]) for curve in curves])
+    x = np.ones((len(curves), length))
+    y = np.zeros((len(curves), length))
+    mask = np.zeros((len(curves), length), dtype=bool)
+    for c in range(len(curves)):
+        x[c, :len(curves[c][2])] = curves[c][2]
+        y[c, :len(curves[c][3])] = curves[c][3]
+        mask[c, :len(curves[c][2])] = True
+    parameters, rsquared = FitSigmoids(x, y, mask, shape == "logistic")
+    bottom, top, middle, slope = parameters.T
+    ec50 = middle if shape == "logistic" else np.exp(middle)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dynamicrange = top / bottom
+
+    with open(fitfilename, "w+") as ffn:
+        ffn.write(", ".join(["model", "species", "ec50", "hill", "leakiness", "maximum", "dynamic_range",
+                             "r_squared"]) + "\n")
+        for c in range(len(curves)):
+            line = [curves[c][0], curves[c][1], ec50[c], slope[c], bottom[c], top[c], dynamicrange[c], rsquared[c]]
+            ffn.write(" ".join([str(v) for v in line]) + "\n")
+    print("{} curves from {} files written to {}.".format(len(curves), len(filenames), fitfilename))
+
+if (__name__ == '__main__'):
+    main(sys.argv[1:])
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+from SweepTools import *
+import numpy as np
+import itertools
+import sys
+
+def main(args):
+    """Function to simulate a model over a multi-dimensional grid of species concentrations and reaction parameters,
+    with one model load. Arguments: 'filename' is a string pointing to the model file in XML (SBML) format.
+    'duration' is the time course duration in seconds. Step count = duration in seconds.
+    All further arguments are grid axes, as read by AxisParser. The grid is every combination of axis values.
+    Options: '--engine', '--mode', '--settle', '--ensemble', '--seed', '--quantiles', '--leap-epsilon', '--critical',
+    '--separation', '--workers', '--cache', '--cache-size' as for ConcentrationRun.py.
+    Output: Grid_(filename)_output.npz holding 'results', with one dimension per axis and a last dimension of
+    time then species concentrations (then settling time with '--settle'; ensemble means, variances & quantiles with
+    '--mode stochastic'), the column names, and the values of each
+    axis as 'axis0', 'axis1', ... with their labels in 'axes'.
+    """
+
+    # Options are separated from the positional arguments first.
+    args, options = SplitOptions(args)
+    try:
+        workers = int(options["workers"])
+    except KeyError:
+        workers = 1
+    mode = SweepMode(options)
+    settle = SettleOptions(options)
+    ensemble = None
+    if mode == "stochastic":
+        settle, ensemble = None, EnsembleOptions(options)
+    cache = CacheOption(options)
+
+    # 'args' is fed to the main function as a tuple. Defining variables & ensuring type is correct.
+    filename = str(args[0])
+    duration = int(args[1])
+    axes = [AxisParser(spec) for spec in args[2:]]
+
+    # Housekeeping.
+    assert isinstance(filename, str)
+    assert isinstance(duration, int)
+    assert len(axes) > 0
+    assert workers >= 1
+
+    # Loading the model once for the whole grid.
+    sessionclass = EngineClass(options)
+    if mode == "stochastic" and not hasattr(sessionclass, "RunEnsemble"):
+        sys.stderr.write("Error. --mode stochastic needs --engine numpy or batch.\n")
+        return 1
+    session = sessionclass(filename, duration)
+    columns = ["time"] + session.speciesids
+    if settle is not None and mode == "time-course":
+        columns.append("settling_time")
+    if mode == "stochastic":
+        columns = EnsembleColumns(session.speciesids, ensemble[2])
+
+    # Grid points in C order: the last axis changes fastest.
+    shape = tuple([len(axis[2]) for axis in axes])
+    points = []
+    for index in itertools.product(*[range(n) for n in shape]):
+        overrides = [axes[a][1](axes[a][2][index[a]]) for a in range(len(axes))]
+        message = "Running {} {} simulation at grid point {} of {}.".format(sessionclass.name, mode,
+                                                                         len(points) + 1, int(np.prod(shape)))
+        points.append((message, overrides))
+
+    try:
+        results = RunSweep(sessionclass, (filename, duration), [], points, [duration],
+                           SweepSettings(workers, mode, settle, ensemble, cache=cache), session)
+    except SimulationError as error:
+        sys.stderr.write(str(error))
+        return 1
+
+    # Each point keeps its final row only.
+    grid = np.array([rows[-1] for rows in results]).reshape(shape + (len(columns),))
+    axisvalues = dict(("axis" + str(a), np.array(axes[a][2])) for a in range(len(axes)))
+    gridfilename = "Grid_" + filename[:-4] + "_output.npz"
+    np.savez(gridfilename, results=grid, columns=np.array(columns), axes=np.array([axis[0] for axis in axes]),
+             **axisvalues)
+    print("Grid of shape {} written to {}.".format(shape, gridfilename))
+
+if (__name__ == '__main__'):
+    main(sys.argv[1:])
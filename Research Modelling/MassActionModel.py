@@ -0,0 +1,869 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+from SweepTools import SimulationError, SettledSince, ApplyOverrides, EnsembleRows, phases
+from scipy.integrate import solve_ivp
+from scipy.sparse import csc_matrix, block_diag, kron, identity
+import xml.etree.ElementTree as ET
+import numpy as np
+import scipy
+import zlib
+import re
+
+# MathML operators understood by the rate law compiler, with the Python/numpy code for each.
+OPERATORS = {"times": " * ", "plus": " + ", "minus": " - ", "divide": " / ", "power": " ** "}
+FUNCTIONS = {"exp": "np.exp", "ln": "np.log"}
+
+# Molecules per mmol, the SBML substance unit of the models.
+AVOGADRO = 6.02214076e20
+
+# LSODA before scipy 1.16 (so every scipy for Python 2.7) takes a banded Jacobian with 'lband' rows of zeros below the
+# diagonals, working space for its band LU factorisation; later versions add the rows themselves.
+LSODAPADDING = tuple(int(part) for part in re.findall(r"[0-9]+", scipy.__version__)[:2]) < (1, 16)
+
+def _Tag(element):
+    "Returns the tag of an XML element without its namespace."
+    return(element.tag.split("}")[-1])
+
+def MathTree(element):
+    """MathTree function. Converts a MathML element into a nested tuple: ("ci", name), ("cn", value) or
+    (operator, [arguments])."""
+    tag = _Tag(element)
+    if tag == "math":
+        return(MathTree(list(element)[0]))
+    if tag == "ci":
+        return(("ci", element.text.strip()))
+    if tag == "cn":
+        if element.get("type") == "e-notation":
+            return(("cn", float(element.text.strip() + "e" + list(element)[0].tail.strip())))
+        return(("cn", float(element.text.strip())))
+    if tag == "apply":
+        children = list(element)
+        operator = _Tag(children[0])
+        if operator not in OPERATORS and operator not in FUNCTIONS:
+            raise ValueError("Unsupported MathML operator: " + operator)
+        return((operator, [MathTree(child) for child in children[1:]]))
+    raise ValueError("Unsupported MathML element: " + tag)
+
+def Depends(tree, name):
+    "Returns True if the expression tree refers to 'name'."
+    if tree[0] == "ci":
+        return(tree[1] == name)
+    if tree[0] == "cn":
+        return(False)
+    return(any(Depends(argument, name) for argument in tree[1]))
+
+def _Zero(tree):
+    return(tree[0] == "cn" and tree[1] == 0.0)
+
+def _Product(factors):
+    "Builds a product tree, dropping factors of one and collapsing to zero."
+    if any(_Zero(factor) for factor in factors):
+        return(("cn", 0.0))
+    factors = [factor for factor in factors if not (factor[0] == "cn" and factor[1] == 1.0)]
+    if not factors:
+        return(("cn", 1.0))
+    if len(factors) == 1:
+        return(factors[0])
+    return(("times", factors))
+
+def _Sum(terms):
+    "Builds a sum tree, dropping zero terms."
+    terms = [term for term in terms if not _Zero(term)]
+    if not terms:
+        return(("cn", 0.0))
+    if len(terms) == 1:
+        return(terms[0])
+    return(("plus", terms))
+
+def Derivative(tree, name):
+    """Derivative function. Differentiates an expression tree with respect to 'name', symbolically.
+    Output: expression tree of the derivative."""
+    if not Depends(tree, name):
+        return(("cn", 0.0))
+    operator = tree[0]
+    if operator == "ci":
+        return(("cn", 1.0))
+    arguments = tree[1]
+    if operator == "plus":
+        return(_Sum([Derivative(argument, name) for argument in arguments]))
+    if operator == "minus":
+        if len(arguments) == 1:
+            return(_Product([("cn", -1.0), Derivative(arguments[0], name)]))
+        return(_Sum([Derivative(arguments[0], name), _Product([("cn", -1.0), Derivative(arguments[1], name)])]))
+    if operator == "times":
+        terms = []
+        for i in range(len(arguments)):
+            terms.append(_Product(arguments[:i] + [Derivative(arguments[i], name)] + arguments[i+1:]))
+        return(_Sum(terms))
+    if operator == "divide":
+        top, bottom = arguments
+        numerator = _Sum([_Product([Derivative(top, name), bottom]),
+                          _Product([("cn", -1.0), top, Derivative(bottom, name)])])
+        return(("divide", [numerator, ("power", [bottom, ("cn", 2.0)])]))
+    if operator == "power":
+        base, exponent = arguments
+        if not Depends(exponent, name):
+            lowered = ("power", [base, _Sum([exponent, ("cn", -1.0)])])
+            return(_Product([exponent, lowered, Derivative(base, name)]))
+        return(_Product([tree, Derivative(("times", [exponent, ("ln", [base])]), name)]))
+    if operator == "exp":
+        return(_Product([tree, Derivative(arguments[0], name)]))
+    if operator == "ln":
+        return(("divide", [Derivative(arguments[0], name), arguments[0]]))
+    raise ValueError("Cannot differentiate: " + operator)
+
+def _Terms(tree):
+    """Expands an expression tree into a list of (sign, term) pairs whose signed sum it is. Sums and differences are
+    multiplied out; a quotient's terms share its denominator, which is taken to be positive."""
+    operator = tree[0]
+    if operator == "cn" and tree[1] < 0:
+        return([(-1.0, ("cn", -tree[1]))])
+    if operator == "plus":
+        return([term for argument in tree[1] for term in _Terms(argument)])
+    if operator == "minus":
+        negated = [(-sign, term) for sign, term in _Terms(tree[1][-1])]
+        if len(tree[1]) == 1:
+            return(negated)
+        return(_Terms(tree[1][0]) + negated)
+    if operator == "times":
+        terms = [(1.0, [])]
+        for argument in tree[1]:
+            terms = [(sign * s, factors + [t]) for sign, factors in terms for s, t in _Terms(argument)]
+        return([(sign, _Product(factors)) for sign, factors in terms])
+    if operator == "divide":
+        return([(sign, ("divide", [term, tree[1][1]])) for sign, term in _Terms(tree[1][0])])
+    return([(1.0, tree)])
+
+def SplitRate(tree):
+    """SplitRate function. Splits a rate law into its forward and reverse parts, each a sum of non-negative terms,
+    so that the law is forward - reverse. A reversible mass-action law k1*A*B - k2*C gives k1*A*B and k2*C.
+    Output: tuple of the forward & reverse expression trees; either may be zero."""
+    terms = _Terms(tree)
+    return((_Sum([term for sign, term in terms if sign > 0]), _Sum([term for sign, term in terms if sign < 0])))
+
+def Code(tree, symbols):
+    """Code function. Writes an expression tree as Python source. 'symbols' maps each name to its source, e.g.
+    "x[2]" for a species or "p[5]" for a parameter."""
+    operator = tree[0]
+    if operator == "ci":
+        return(symbols[tree[1]])
+    if operator == "cn":
+        return(repr(tree[1]))
+    arguments = [Code(argument, symbols) for argument in tree[1]]
+    if operator in FUNCTIONS:
+        return(FUNCTIONS[operator] + "(" + arguments[0] + ")")
+    if operator == "minus" and len(arguments) == 1:
+        return("(-" + arguments[0] + ")")
+    return("(" + OPERATORS[operator].join(arguments) + ")")
+
+class MassActionModel(object):
+    """Reaction network read from an SBML level 2 file: species, a stoichiometry matrix, parameters and rate laws
+    compiled to Python functions with their analytic Jacobian. Rate laws are in amount per second, as SBML kinetic
+    laws are; concentration rates are the stoichiometric sum divided by the species' compartment volume."""
+
+    def __init__(self, filename):
+        root = ET.parse(filename).getroot()
+        sbmlmodel = [child for child in root if _Tag(child) == "model"][0]
+        sections = dict((_Tag(child), child) for child in sbmlmodel)
+
+        # Compartments & global parameters share one parameter vector with the local reaction parameters.
+        self.parameterids = []
+        self.parametervalues = []
+        self.parameterindex = {}
+        volumes = {}
+        for compartment in sections.get("listOfCompartments", []):
+            volumes[compartment.get("id")] = float(compartment.get("size", 1.0))
+            self._AddParameter(compartment.get("id"), volumes[compartment.get("id")])
+        for parameter in sections.get("listOfParameters", []):
+            self._AddParameter(parameter.get("id"), float(parameter.get("value")))
+
+        # Species, in SBML order. Concentrations in mmol/ml, per the SBML 2 input specification.
+        self.speciesids = []
+        self.speciesnames = []
+        self.initial = []
+        self.volumes = []
+        self.fixed = []
+        for species in sections.get("listOfSpecies", []):
+            volume = volumes[species.get("compartment")]
+            self.speciesids.append(species.get("id"))
+            self.speciesnames.append(species.get("name", species.get("id")))
+            if species.get("initialConcentration") is not None:
+                self.initial.append(float(species.get("initialConcentration")))
+            else:
+                self.initial.append(float(species.get("initialAmount", 0.0)) / volume)
+            self.volumes.append(volume)
+            self.fixed.append(species.get("boundaryCondition") == "true" or species.get("constant") == "true")
+        self.initial = np.array(self.initial)
+        self.volumes = np.array(self.volumes)
+
+        # Reactions: stoichiometry and rate law trees, with local parameters renamed "reaction.parameter".
+        self.reactionids = []
+        self.reactionnames = []
+        self.ratetrees = []
+        reactions = list(sections.get("listOfReactions", []))
+        self.stoichiometry = np.zeros((len(self.speciesids), len(reactions)))
+        self.reactants = np.zeros((len(self.speciesids), len(reactions)))
+        self.products = np.zeros((len(self.speciesids), len(reactions)))
+        for j in range(len(reactions)):
+            reaction = reactions[j]
+            reactionid = reaction.get("id")
+            self.reactionids.append(reactionid)
+            self.reactionnames.append(reaction.get("name", reactionid))
+            parts = dict((_Tag(child), child) for child in reaction)
+            for listname, sign in (("listOfReactants", -1.0), ("listOfProducts", 1.0)):
+                for reference in parts.get(listname, []):
+                    i = self.speciesids.index(reference.get("species"))
+                    coefficient = sign * float(reference.get("stoichiometry", 1))
+                    self.stoichiometry[i, j] = self.stoichiometry[i, j] + coefficient
+                    if sign < 0:
+                        self.reactants[i, j] = self.reactants[i, j] - coefficient
+                    else:
+                        self.products[i, j] = self.products[i, j] + coefficient
+            kineticlaw = dict((_Tag(child), child) for child in parts["kineticLaw"])
+            local = {}
+            for parameter in kineticlaw.get("listOfParameters", []):
+                local[parameter.get("id")] = reactionid + "." + parameter.get("id")
+                self._AddParameter(local[parameter.get("id")], float(parameter.get("value")))
+            self.ratetrees.append(self._Rename(MathTree(kineticlaw["math"]), local))
+        for i in range(len(self.speciesids)):
+            if self.fixed[i]:
+                self.stoichiometry[i, :] = 0.0
+        self.parametervalues = np.array(self.parametervalues)
+
+        # Concentration stoichiometry: d[concentration]/dt = self.concstoichiometry . rates.
+        self.concstoichiometry = self.stoichiometry / self.volumes[:, np.newaxis]
+        self._Compile()
+
+    def _AddParameter(self, name, value):
+        self.parameterindex[name] = len(self.parameterids)
+        self.parameterids.append(name)
+        self.parametervalues.append(value)
+
+    def _Rename(self, tree, local):
+        "Renames local parameter references in a rate law tree to their reaction-qualified names."
+        if tree[0] == "ci":
+            return(("ci", local.get(tree[1], tree[1])))
+        if tree[0] == "cn":
+            return(tree)
+        return((tree[0], [self._Rename(argument, local) for argument in tree[1]]))
+
+    def Symbols(self):
+        "Returns the name-to-source mapping for compiled functions of the state 'x' and parameters 'p'."
+        symbols = {}
+        for i in range(len(self.speciesids)):
+            symbols[self.speciesids[i]] = "x[" + str(i) + "]"
+        for k in range(len(self.parameterids)):
+            symbols[self.parameterids[k]] = "p[" + str(k) + "]"
+        return(symbols)
+
+    def Function(self, expressions):
+        "Compiles a list of expression trees into one function f(x, p) returning the list of their values."
+        source = "def f(x, p):\n    return([" + ", ".join([Code(tree, self.Symbols()) for tree in expressions]) + "])\n"
+        namespace = {"np": np}
+        exec(compile(source, "<MassActionModel>", "exec"), namespace)
+        return(namespace["f"])
+
+    def _Compile(self):
+        "Compiles the rate laws and the non-zero entries of their derivatives with respect to each species."
+        self._rates = self.Function(self.ratetrees)
+        entries = []
+        self.jacobianrows = []
+        self.jacobiancolumns = []
+        for j in range(len(self.ratetrees)):
+            for i in range(len(self.speciesids)):
+                derivative = Derivative(self.ratetrees[j], self.speciesids[i])
+                if not _Zero(derivative):
+                    entries.append(derivative)
+                    self.jacobianrows.append(j)
+                    self.jacobiancolumns.append(i)
+        self._ratejacobian = self.Function(entries)
+        self._parameterjacobians = {}
+
+        # Stochastic reaction channels: each rate law split into a forward channel and, for a reversible law, a
+        # reverse channel that fires the reaction backwards, consuming its products. 'channelpairs' lists the forward &
+        # reverse channels of each reversible law, and 'channeldepends' marks the species each channel's rate uses.
+        channels = []
+        self.channelstoichiometry = []
+        self.channelreactants = []
+        self.channelpairs = []
+        for j in range(len(self.ratetrees)):
+            forward, reverse = SplitRate(self.ratetrees[j])
+            for tree, sign, consumed in ((forward, 1.0, self.reactants), (reverse, -1.0, self.products)):
+                if not _Zero(tree):
+                    channels.append(tree)
+                    self.channelstoichiometry.append(sign * self.stoichiometry[:, j])
+                    self.channelreactants.append(consumed[:, j])
+            if not _Zero(forward) and not _Zero(reverse):
+                self.channelpairs.append((len(channels) - 2, len(channels) - 1))
+        self.channelstoichiometry = np.array(self.channelstoichiometry).reshape(-1, len(self.speciesids)).T
+        self.channelreactants = np.array(self.channelreactants).reshape(-1, len(self.speciesids)).T
+        self.channeldepends = np.array([[Depends(tree, speciesid) for speciesid in self.speciesids]
+                                        for tree in channels], dtype=bool).reshape(-1, len(self.speciesids))
+        self.channeltrees = channels
+        self._propensities = self.Function(channels)
+
+    def Rates(self, x, p):
+        """Returns the reaction rates in amount per second for the state 'x' and parameter vector 'p'. For a batch,
+        'x' is species x points and 'p' parameters x points, and the rates are reactions x points."""
+        values = self._rates(x, p)
+        if np.ndim(x) > 1:
+            values = np.broadcast_arrays(*values)
+        return(np.array(values, dtype=float))
+
+    def Propensities(self, x, p):
+        """Returns the rates of the stochastic reaction channels in amount per second, laid out as for Rates, with
+        one channel per irreversible reaction and two, forward & reverse, per reversible one."""
+        values = self._propensities(x, p)
+        if np.ndim(x) > 1:
+            values = np.broadcast_arrays(*values)
+        return(np.array(values, dtype=float))
+
+    def RateJacobian(self, x, p):
+        """Returns the derivatives of the reaction rates with respect to species concentrations, reactions x species.
+        For a batch, as for Rates, the output is points x reactions x species."""
+        values = self._ratejacobian(x, p)
+        if np.ndim(x) > 1:
+            jacobian = np.zeros((np.shape(x)[1], len(self.reactionids), len(self.speciesids)))
+            jacobian[:, self.jacobianrows, self.jacobiancolumns] = np.array(np.broadcast_arrays(*values)).T
+            return(jacobian)
+        jacobian = np.zeros((len(self.reactionids), len(self.speciesids)))
+        jacobian[self.jacobianrows, self.jacobiancolumns] = values
+        return(jacobian)
+
+    def Derivatives(self, x, p):
+        "Returns d[concentration]/dt for every species."
+        return(self.concstoichiometry.dot(self.Rates(x, p)))
+
+    def Jacobian(self, x, p):
+        """Returns the analytic Jacobian of Derivatives with respect to species concentrations. For a batch, the
+        output is points x species x species."""
+        if np.ndim(x) > 1:
+            return(np.einsum("sr,nrc->nsc", self.concstoichiometry, self.RateJacobian(x, p)))
+        return(self.concstoichiometry.dot(self.RateJacobian(x, p)))
+
+    def ParameterJacobian(self, x, p, parameterids):
+        """Returns the analytic derivatives of Derivatives with respect to the parameters named, species x parameters.
+        The rate law derivatives for each list of parameters are compiled on first use."""
+        key = tuple(parameterids)
+        if key not in self._parameterjacobians:
+            entries = []
+            rows = []
+            columns = []
+            for j in range(len(self.ratetrees)):
+                for k in range(len(key)):
+                    derivative = Derivative(self.ratetrees[j], key[k])
+                    if not _Zero(derivative):
+                        entries.append(derivative)
+                        rows.append(j)
+                        columns.append(k)
+            self._parameterjacobians[key] = (self.Function(entries), rows, columns)
+        function, rows, columns = self._parameterjacobians[key]
+        jacobian = np.zeros((len(self.reactionids), len(key)))
+        jacobian[rows, columns] = function(x, p)
+        return(self.concstoichiometry.dot(jacobian))
+
+    def ConservationMatrix(self):
+        """Returns a matrix whose rows are conserved moieties: linear combinations of concentrations that the
+        network cannot change. Found as the left null space of the concentration stoichiometry."""
+        if self.concstoichiometry.shape[1] == 0:
+            return(np.eye(len(self.speciesids)))
+        u, s, vt = np.linalg.svd(self.concstoichiometry.T)
+        rank = int(np.sum(s > s.max() * 1.0e-10))
+        return(vt[rank:])
+
+    def SpeciesIndex(self, speciesname):
+        "Returns the index of a species given its SBML id or name."
+        if speciesname in self.speciesids:
+            return(self.speciesids.index(speciesname))
+        return(self.speciesnames.index(speciesname))
+
+    def ParameterIndex(self, reactionname, parametername):
+        "Returns the parameter vector index of a reaction parameter, given the reaction's SBML id or name."
+        if reactionname not in self.reactionids:
+            reactionname = self.reactionids[self.reactionnames.index(reactionname)]
+        name = reactionname + "." + parametername
+        if name not in self.parameterindex:
+            name = parametername
+        return(self.parameterindex[name])
+
+def CountSolver(solution):
+    "Adds the statistics of one solve_ivp run to the phase timer's counters."
+    phases.Count("integrations")
+    phases.Count("function evaluations", solution.nfev)
+    phases.Count("Jacobian evaluations", solution.njev)
+    phases.Count("LU decompositions", solution.nlu)
+
+class MassActionSession(object):
+    """Session with the same interface as CopasiSession, backed by MassActionModel and scipy's stiff solvers
+    instead of COPASI. Arguments: 'filename' is the model file in XML (SBML) format. 'duration' is the time course
+    duration in seconds; step count = duration in seconds. 'method' is the solve_ivp method. Default: LSODA, as
+    COPASI uses. Tolerances default to COPASI's: relative 1e-6 & the absolute 1e-12 set by the run scripts."""
+
+    name = "numpy"
+    solver = "LSODA rtol=1e-6 atol=1e-12"
+
+    def __init__(self, filename, duration, method="LSODA", rtol=1.0e-6, atol=1.0e-12):
+        with phases.Phase("model load"):
+            self.network = MassActionModel(filename)
+        self.speciesids = list(self.network.speciesids)
+        self.duration = duration
+        self.method = method
+        self.rtol = rtol
+        self.atol = atol
+        self.state = self.network.initial.copy()
+        self.parameters = self.network.parametervalues.copy()
+
+    def SetSpecies(self, speciesname, value):
+        "Sets the initial concentration of a species, in mmol/ml."
+        self.state[self.network.SpeciesIndex(speciesname)] = value
+
+    def SetParameter(self, reactionname, parametername, value):
+        "Sets the value of a named parameter of a reaction."
+        self.parameters[self.network.ParameterIndex(reactionname, parametername)] = value
+
+    def GetTolerances(self):
+        "Returns the solver's relative & absolute tolerances."
+        return((self.rtol, self.atol))
+
+    def SetTolerances(self, rtol, atol):
+        "Sets the solver's relative & absolute tolerances."
+        self.rtol = rtol
+        self.atol = atol
+
+    def GetState(self):
+        "Returns the initial concentrations of all species, in report order."
+        return(self.state.copy())
+
+    def SetState(self, state):
+        "Sets the initial concentrations of all species, in report order, e.g. from the final row of another run."
+        self.state = np.array(state[:len(self.speciesids)], dtype=float)
+
+    def Integrate(self, state, start, times):
+        """Integrates from 'state' at time 'start' and returns the rows (time, then species) at each of 'times',
+        which must be sorted."""
+        p = self.parameters
+        with phases.Phase("integration"):
+            solution = solve_ivp(lambda t, x: self.network.Derivatives(x, p), (start, times[-1]), state,
+                                 method=self.method, t_eval=times, rtol=self.rtol, atol=self.atol,
+                                 jac=lambda t, x: self.network.Jacobian(x, p))
+        CountSolver(solution)
+        if not solution.success:
+            raise SimulationError("Error. Running the time course simulation failed.\n" + solution.message + "\n")
+        return(np.vstack((solution.t, solution.y)).T)
+
+    def Run(self, steps, target=""):
+        """Runs the time course from the current initial values. Arguments: 'steps' lists the step numbers to keep.
+        'target' is a paging file for the full time course, written as the COPASI report would be; empty for none.
+        Output: array of kept rows, time followed by species concentrations in report order."""
+        if target:
+            rows = self.Integrate(self.state, 0.0, np.arange(self.duration + 1, dtype=float))
+            with open(target, "w+") as ofn:
+                ofn.write(", ".join(["time"] + self.speciesids) + "\n")
+                for row in rows:
+                    ofn.write(", ".join([str(float(x)) for x in row]) + "\n")
+            return(rows[list(steps)])
+        times = np.unique(np.array(steps, dtype=float))
+        rows = self.Integrate(self.state, 0.0, times)
+        return(rows[np.searchsorted(times, steps)])
+
+    def RunSettled(self, window, rtol, atol):
+        """Runs the time course in segments of 'window' seconds and stops once a segment shows every species within
+        rtol * |concentration| + atol of its state at the full duration, as SettledSince estimates it, or at the full
+        duration. Output: array with one row, laid out as for Run, with the settling time appended (nan if the time
+        course never settled)."""
+        state = self.state
+        elapsed = 0
+        settled = float("nan")
+        while elapsed < self.duration:
+            segment = min(window, self.duration - elapsed)
+            rows = self.Integrate(state, float(elapsed), np.arange(elapsed, elapsed + segment + 1, dtype=float))
+            elapsed = elapsed + segment
+            # The last segment ends the time course anyway, so only a segment with time left after it can settle.
+            left = self.duration - elapsed
+            if segment == window and left > 0 and SettledSince(rows, rtol, atol, left):
+                settled = rows[0, 0]
+                break
+            state = rows[-1, 1:]
+        return(np.array([list(rows[-1]) + [settled]]))
+
+    def Newton(self, state, iterations=50):
+        """Newton's method on the rate equations, with conserved moieties held at their values in 'state'.
+        Output: the converged state, or None if Newton failed or went negative."""
+        conservation = self.network.ConservationMatrix()
+        totals = conservation.dot(state)
+        x = np.array(state, dtype=float)
+        for n in range(iterations):
+            phases.Count("Newton iterations")
+            residual = np.concatenate((self.network.Derivatives(x, self.parameters), conservation.dot(x) - totals))
+            jacobian = np.vstack((self.network.Jacobian(x, self.parameters), conservation))
+            step = np.linalg.lstsq(jacobian, -residual, rcond=None)[0]
+            x = x + step
+            if np.all(np.abs(step) <= self.rtol * np.abs(x) + self.atol):
+                if np.any(x < -self.atol):
+                    return(None)
+                return(np.maximum(x, 0.0))
+        return(None)
+
+    def RunEnsemble(self, steps, size, seed, quantiles, epsilon=0.03, critical=10, separation=10.0):
+        """Runs an ensemble of 'size' stochastic time courses from the current initial values, all at once, and
+        summarises them at each kept step. Concentrations are turned into molecule counts in each species' compartment,
+        rounded up or down at random so the mean count is kept, and the reactions fire as discrete events. A reversible
+        reaction is two channels, its forward and reverse rate laws, as Propensities gives.
+        Trajectories advance by tau-leaping (Cao, Gillespie & Petzold 2006). A channel that changes a species with
+        fewer copies than 'critical' firings' worth is critical: it fires at most once per leap, at an exponentially
+        distributed time that ends the leap, while every other channel fires a Poisson number of times. Scarce species
+        such as mRNAs with a few copies thus change one event at a time, as in an exact run. (Cao, Gillespie & Petzold
+        only make the channels that could use a species up critical, but then a leap may move a handful of copies by
+        one while the rates that depend on them stay put, which biases their means by several percent.) The leap is
+        kept short enough that the non-critical channels change no reactant's propensity by more than the fraction
+        'epsilon'. Trajectories where a leap would hold fewer than 3 events, counting its end at the first critical
+        firing, take exact Gillespie direct method steps instead, and leaps that would make a count negative are
+        halved and retried.
+        A reversible reaction whose channels are both critical, such as a promoter with a few copies binding &
+        unbinding, is taken at equilibrium when its flow each way is at least 'separation' times the rate of the
+        channels that use or change its scarce species (the slow-scale approximation of Cao, Gillespie & Petzold 2005).
+        The channels whose rates depend on it then fire at their mean over its stationary distribution, found exactly
+        by detailed balance over the few states it can reach, and its extent is drawn from that distribution at the end
+        of each step, weighted by the rate of any channel that fired, so its own fast events are never simulated one
+        by one. A 'separation' of 0 turns this off.
+        Each trajectory has its own clock; all are advanced together with numpy. The random numbers are seeded from
+        'seed' and the point's initial state & parameters, so a point gives the same ensemble whatever process or order
+        it runs in.
+        Output: array with one row per kept step, laid out as EnsembleRows gives."""
+        network = self.network
+        p = self.parameters
+        random = np.random.RandomState([seed, zlib.crc32(np.concatenate((self.state, p)).tobytes()) & 0xffffffff])
+        scale = AVOGADRO * network.volumes
+        stoichiometry = network.channelstoichiometry
+        # The species each channel changes & by how many per firing, padded with amounts of zero, for finding the
+        # critical channels.
+        changes = [np.nonzero(column)[0] for column in stoichiometry.T]
+        width = max([1] + [len(c) for c in changes])
+        touched = np.zeros((len(changes), width), dtype=int)
+        amounts = np.zeros((len(changes), width))
+        for j in range(len(changes)):
+            touched[j, :len(changes[j])] = changes[j]
+            amounts[j, :len(changes[j])] = np.abs(stoichiometry[changes[j], j])
+        # Highest order of the channels each species is a reactant of, for the leap condition. Species that are no
+        # channel's reactant do not limit the leap.
+        reactants = np.nonzero(np.any(network.channelreactants > 0, axis=1))[0]
+        orders = network.channelreactants.sum(axis=0)
+        highest = np.max(np.where(network.channelreactants > 0, orders[np.newaxis, :], 1.0), axis=1)[reactants]
+        change = stoichiometry[reactants].T
+        # Reversible reactions that may be taken at equilibrium, each with the channels whose rates depend on the
+        # species it changes, compiled on their own, and the channels that use or change each of those species. One
+        # that shares species with an earlier one, or whose dependent channels also depend on an earlier one's
+        # species, is left out, so that their equilibria are independent.
+        involves = network.channeldepends | (stoichiometry.T != 0)
+        pairs = []
+        taken = np.zeros(len(self.speciesids), dtype=bool)
+        for f, b in network.channelpairs if separation > 0 else []:
+            changed = stoichiometry[:, f] != 0
+            dependent = np.nonzero(np.any(network.channeldepends[:, changed], axis=1))[0]
+            if not np.any(changed & taken) and not np.any(network.channeldepends[dependent][:, taken]):
+                involved = involves[:, changed].T.astype(float)
+                involved[:, [f, b]] = 0.0
+                pairs.append((f, b, dependent, network.Function([network.channeltrees[j] for j in dependent]),
+                              changed, involved))
+                taken = taken | changed
+        mean = self.state * scale
+        counts = np.floor(mean) + (random.random_sample((size, len(mean))) < mean - np.floor(mean))
+        times = np.unique(np.array(steps, dtype=float))
+        samples = np.empty((len(times), size, len(mean)))
+        clock = np.zeros(size)
+        following = np.zeros(size, dtype=int)
+        with phases.Phase("integration"):
+            while True:
+                # Recording the trajectories that have reached their next kept time.
+                due = np.nonzero(clock >= times[np.minimum(following, len(times) - 1)])[0]
+                due = due[following[due] < len(times)]
+                samples[following[due], due] = counts[due]
+                following[due] = following[due] + 1
+                active = np.nonzero(following < len(times))[0]
+                if len(active) == 0:
+                    break
+                x = counts[active]
+                propensities = network.Propensities((x / scale).T, p).T * AVOGADRO
+                if np.any(propensities < 0):
+                    raise SimulationError("Error. A reaction channel has a negative propensity; stochastic runs need "
+                                          "non-negative parameters & rate law terms.\n")
+                draws = [self._Equilibrate(x, propensities, pair, critical, separation, scale) for pair in pairs]
+                total = propensities.sum(axis=1)
+                target = times[following[active]]
+                remaining = target - clock[active]
+                # Critical channels: those changing a species with fewer than 'critical' firings' worth of copies.
+                criticalrates = np.where(np.any(x[:, touched] < critical * amounts, axis=2), propensities, 0.0)
+                noncritical = propensities - criticalrates
+                criticaltotal = criticalrates.sum(axis=1)
+                # Leap size from the expected drift and spread of each reactant's count under the non-critical channels.
+                drift = np.abs(noncritical.dot(change))
+                spread = noncritical.dot(change ** 2)
+                bound = np.maximum(epsilon * x[:, reactants] / highest, 1.0)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    limits = np.fmin(bound / drift, bound ** 2 / spread)
+                tau = np.min(np.where(spread > 0, limits, np.inf), axis=1)
+                tau = np.minimum(tau, remaining)
+                # Each step costs about the same whether it leaps or not, so leaping pays once a leap holds 3 events;
+                # one is cut short at its critical firing, expected after 1 / criticaltotal.
+                with np.errstate(divide="ignore"):
+                    expected = np.minimum(tau, 1.0 / criticaltotal)
+                exact = (expected < 3.0 / np.maximum(total, 1e-300)) & (total > 0)
+                # Exact steps. A trajectory whose next event falls after its next kept time stops at that time.
+                e = np.nonzero(exact)[0]
+                if len(e) > 0:
+                    phases.Count("exact steps", len(e))
+                    wait = random.exponential(1.0, len(e)) / total[e]
+                    fires = wait < remaining[e]
+                    chosen = (np.cumsum(propensities[e], axis=1) <
+                              (random.random_sample(len(e)) * total[e])[:, np.newaxis]).sum(axis=1)
+                    chosen = np.minimum(chosen, stoichiometry.shape[1] - 1)
+                    fired = np.where(fires, chosen, -1)
+                    counts[active[e]] = (x[e] + self._Draw(draws, e, fired, random) +
+                                         np.where(fires[:, np.newaxis], stoichiometry[:, chosen].T, 0.0))
+                    clock[active[e]] = np.where(fires, clock[active[e]] + wait, target[e])
+                # Leaps, halved until no count goes negative. A critical channel fires if its waiting time comes
+                # before the leap ends, which then ends there.
+                l = np.nonzero(~exact)[0]
+                while len(l) > 0:
+                    phases.Count("leaps", len(l))
+                    with np.errstate(divide="ignore"):
+                        wait = random.exponential(1.0, len(l)) / criticaltotal[l]
+                    fires = wait < tau[l]
+                    step = np.where(fires, wait, tau[l])
+                    means = noncritical[l] * step[:, np.newaxis]
+                    firings = np.zeros(means.shape)
+                    firing = means > 0
+                    firings[firing] = random.poisson(means[firing])
+                    f = np.nonzero(fires)[0]
+                    chosen = (np.cumsum(criticalrates[l[f]], axis=1) <
+                              (random.random_sample(len(f)) * criticaltotal[l[f]])[:, np.newaxis]).sum(axis=1)
+                    fired = -np.ones(len(l), dtype=int)
+                    fired[f] = np.minimum(chosen, stoichiometry.shape[1] - 1)
+                    firings[f, fired[f]] = 1.0
+                    updated = x[l] + self._Draw(draws, l, fired, random) + firings.dot(stoichiometry.T)
+                    negative = np.any(updated < 0, axis=1)
+                    kept = l[~negative]
+                    counts[active[kept]] = updated[~negative]
+                    # A leap to the next kept time lands on it exactly.
+                    clock[active[kept]] = np.where(step[~negative] < remaining[kept], clock[active[kept]] +
+                                                   step[~negative], target[kept])
+                    phases.Count("critical firings", np.count_nonzero(fires[~negative]))
+                    l = l[negative]
+                    tau[l] = tau[l] / 2.0
+                    phases.Count("rejected leaps", len(l))
+        samples = samples / scale
+        return(EnsembleRows(times, samples, quantiles)[np.searchsorted(times, steps)])
+
+    def _Equilibrate(self, x, propensities, pair, critical, separation, scale):
+        """Takes a reversible reaction at equilibrium in the trajectories where it is fast, for RunEnsemble. 'x' &
+        'propensities' are the counts & channel rates of the trajectories; in those where it is fast the rates of the
+        channels that depend on it become their mean over its stationary distribution, and its own channels' rates
+        become zero. 'pair' is as RunEnsemble lists it. Output: the distribution, for _Draw, or None if the reaction is
+        nowhere fast."""
+        f, b, dependent, function, changed, involved = pair
+        nu = self.network.channelstoichiometry[:, f]
+        # The extent, net forward firings from now, is bounded by the counts each direction uses up.
+        forwards, backwards = np.nonzero(nu < 0)[0], np.nonzero(nu > 0)[0]
+        up = np.min(np.floor(x[:, forwards] / -nu[forwards]), axis=1) if len(forwards) else np.inf
+        down = np.min(np.floor(x[:, backwards] / nu[backwards]), axis=1) if len(backwards) else np.inf
+        c = np.nonzero((up < critical) & (down < critical) & (propensities[:, f] + propensities[:, b] > 0))[0]
+        if len(c) == 0:
+            return(None)
+        up, down = up[c], down[c]
+        extents = np.arange(int(np.max(up + down)) + 1)[np.newaxis, :] - down[:, np.newaxis]
+        reachable = extents <= up[:, np.newaxis]
+        extents = np.where(reachable, extents, 0.0)
+        states = (x[c][:, np.newaxis, :] + extents[:, :, np.newaxis] * nu).reshape(-1, len(nu))
+        rates = np.array(np.broadcast_arrays(*function((states / scale).T, self.parameters)), dtype=float) * AVOGADRO
+        rates = rates.T.reshape(len(c), extents.shape[1], len(dependent))
+        columns = -np.ones(len(propensities[0]) + 1, dtype=int)
+        columns[dependent] = np.arange(len(dependent))
+        # Detailed balance: the probability of extent k + 1 over that of k is the forward rate at k over the reverse
+        # rate at k + 1.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            steps = np.log(rates[:, :-1, columns[f]]) - np.log(rates[:, 1:, columns[b]])
+            logs = np.where(reachable, np.concatenate((np.zeros((len(c), 1)), np.cumsum(steps, axis=1)), axis=1),
+                            -np.inf)
+            distribution = np.exp(logs - np.max(logs, axis=1)[:, np.newaxis])
+            distribution = distribution / distribution.sum(axis=1)[:, np.newaxis]
+        averages = np.einsum("ck,ckj->cj", distribution, rates)
+        # Fast enough when its flow each way outpaces the other channels that use or change its scarce species.
+        rows = propensities[c]
+        rows[:, dependent] = averages
+        scarce = x[c][:, changed] < critical * np.abs(nu[changed])
+        slow = np.sum(rows * (scarce.dot(involved) > 0), axis=1)
+        fast = np.all(np.isfinite(distribution), axis=1) & (rows[:, f] > 0) & (rows[:, f] >= separation * slow)
+        if not np.any(fast):
+            return(None)
+        phases.Count("equilibrium draws", np.count_nonzero(fast))
+        c, rows = c[fast], rows[fast]
+        rows[:, [f, b]] = 0.0
+        propensities[c] = rows
+        positions = -np.ones(len(x), dtype=int)
+        positions[c] = np.arange(len(c))
+        return((positions, extents[fast], distribution[fast], rates[fast], columns, nu))
+
+    def _Draw(self, draws, rows, fired, random):
+        """Draws the extents of the reactions taken at equilibrium, for RunEnsemble. 'draws' are as _Equilibrate gives,
+        'rows' the trajectories stepping and 'fired' the one channel each fires singly, or -1. A channel whose rate
+        depends on a reaction's extent is likelier to fire from some extents than others, so the extent is drawn from
+        the stationary distribution weighted by that rate, which also keeps the counts it uses up available.
+        Output: the change in counts, rows x species."""
+        shift = np.zeros((len(rows), len(self.speciesids)))
+        for draw in draws:
+            if draw is None:
+                continue
+            positions, extents, distribution, rates, columns, nu = draw
+            where = positions[rows]
+            m = np.nonzero(where >= 0)[0]
+            if len(m) == 0:
+                continue
+            where, column = where[m], columns[fired[m]]
+            weights = distribution[where] * np.where(column[:, np.newaxis] >= 0,
+                                                     rates[where, :, np.maximum(column, 0)], 1.0)
+            totals = weights.sum(axis=1)
+            drawn = (np.cumsum(weights, axis=1) < (random.random_sample(len(m)) * totals)[:, np.newaxis]).sum(axis=1)
+            drawn = np.minimum(drawn, weights.shape[1] - 1)
+            shift[m] = shift[m] + extents[where, drawn][:, np.newaxis] * nu
+        return(shift)
+
+    def RunSensitivities(self, parameterids, steadystate=False):
+        """Computes the sensitivities of every species concentration to the parameters named, from the current initial
+        values, in one pass. At the end of the time course they come from the forward sensitivity equations,
+        dS/dt = J S + dF/dp with S = 0 at the start, integrated alongside the time course. With 'steadystate' they
+        come from the steady state found by RunSteadyState, solving J S = -dF/dp with conserved moieties held fixed;
+        if no steady state is found, the end of the time course is used instead.
+        Output: tuple of the final row, laid out as for Run, and the sensitivities d concentration / d parameter as a
+        species x parameters array."""
+        network = self.network
+        p = self.parameters
+        size = len(self.speciesids)
+        count = len(parameterids)
+        if steadystate:
+            rows = self.RunSteadyState()
+            if np.isinf(rows[0, 0]):
+                x = rows[0, 1:]
+                conservation = network.ConservationMatrix()
+                jacobian = np.vstack((network.Jacobian(x, p), conservation))
+                forcing = np.vstack((-network.ParameterJacobian(x, p, parameterids),
+                                     np.zeros((conservation.shape[0], count))))
+                return((rows, np.linalg.lstsq(jacobian, forcing, rcond=None)[0]))
+        def derivatives(t, y):
+            x = y[:size]
+            sensitivities = y[size:].reshape(size, count)
+            dsdt = network.Jacobian(x, p).dot(sensitivities) + network.ParameterJacobian(x, p, parameterids)
+            return(np.concatenate((network.Derivatives(x, p), dsdt.ravel())))
+        # The solver's Jacobian leaves out how J S depends on the state; the Newton iterations only need an
+        # approximation, and each block is the model's own Jacobian.
+        def jacobian(t, y):
+            blocks = network.Jacobian(y[:size], p)
+            return(block_diag([blocks] + [kron(blocks, identity(count))], format="csc"))
+        initial = np.concatenate((self.state, np.zeros(size * count)))
+        with phases.Phase("integration"):
+            solution = solve_ivp(derivatives, (0.0, float(self.duration)), initial, method="BDF",
+                                 t_eval=[float(self.duration)], rtol=self.rtol, atol=self.atol, jac=jacobian)
+        CountSolver(solution)
+        if not solution.success:
+            raise SimulationError("Error. Running the sensitivity equations failed.\n" + solution.message + "\n")
+        final = solution.y[:, -1]
+        return((np.array([[solution.t[-1]] + list(final[:size])]), final[size:].reshape(size, count)))
+
+    def RunSteadyState(self):
+        """Finds the steady state with Newton's method from the current initial values. If Newton fails, the full
+        time course is run and Newton retried from its final state; failing that, the final state is kept.
+        Output: array with one row, laid out as for Run. The time of a converged steady state is recorded as inf."""
+        x = self.Newton(self.state)
+        if x is not None:
+            return(np.array([[float("inf")] + list(x)]))
+        phases.Count("Newton failures")
+        rows = self.Run([self.duration])
+        x = self.Newton(rows[-1, 1:])
+        if x is not None:
+            return(np.array([[float("inf")] + list(x)]))
+        return(rows)
+
+class BatchSession(MassActionSession):
+    """MassActionSession that integrates a whole sweep as one ODE system. Every point shares the network, so the
+    states stack into a species x points array, rate laws are evaluated for all points at once with numpy
+    broadcasting, and the solver sees a block-diagonal Jacobian. 'method' defaults to LSODA, as for a single point,
+    which takes the Jacobian as a band; BDF and Radau take it as a sparse matrix. Points that are not plain time
+    courses run one at a time as in MassActionSession."""
+
+    name = "numpy batch"
+    solver = "LSODA banded rtol=1e-6 atol=1e-12"
+    batch = True
+
+    def __init__(self, filename, duration, method="LSODA", rtol=1.0e-6, atol=1.0e-12):
+        MassActionSession.__init__(self, filename, duration, method, rtol, atol)
+
+    def RunBatch(self, overridelist, steps, targets=None):
+        """Runs the time courses of many sweep points together. Arguments: 'overridelist' holds the list of model
+        changes for each point, as for ApplyOverrides. 'steps' lists the step numbers to keep. 'targets' optionally
+        gives a paging file per point. Output: list of row arrays, one per point, as Run returns."""
+        count = len(overridelist)
+        size = len(self.speciesids)
+        # Each point's changes are applied to the session in turn, to capture its initial state & parameters.
+        states = np.empty((size, count))
+        parameters = np.empty((len(self.parameters), count))
+        state, values = self.state.copy(), self.parameters.copy()
+        for k in range(count):
+            ApplyOverrides(self, overridelist[k])
+            states[:, k] = self.state
+            parameters[:, k] = self.parameters
+            self.state, self.parameters = state.copy(), values.copy()
+
+        # Flattened point by point, so the Jacobian is block-diagonal with one species x species block per point.
+        network = self.network
+        def derivatives(t, y):
+            return(network.Derivatives(y.reshape(count, size).T, parameters).T.ravel())
+        species, partners = [index.ravel() for index in np.indices((size, size))]
+        blocks = np.arange(count)[:, np.newaxis] * size
+        if self.method == "LSODA":
+            # A block-diagonal matrix is banded, so LSODA factorises it in time linear in the number of points. Its
+            # Jacobian is passed packed by diagonal, entry (i, j) at (i - j + band, j), padded for older scipy.
+            band = size - 1
+            options = {"lband": band, "uband": band}
+            bandrows = np.tile(species - partners + band, count)
+            bandcolumns = (blocks + partners).ravel()
+            height = 3 * band + 1 if LSODAPADDING else 2 * band + 1
+            def jacobian(t, y):
+                packed = np.zeros((height, count * size))
+                packed[bandrows, bandcolumns] = network.Jacobian(y.reshape(count, size).T, parameters).ravel()
+                return(packed)
+        else:
+            # Other implicit methods take a sparse matrix. Its layout is built once; each evaluation refills it.
+            options = {}
+            layout = csc_matrix((np.arange(1, count * size * size + 1, dtype=float),
+                                 ((blocks + species).ravel(), (blocks + partners).ravel())),
+                                shape=(count * size, count * size))
+            order = layout.data.astype(int) - 1
+            def jacobian(t, y):
+                matrix = layout.copy()
+                matrix.data = network.Jacobian(y.reshape(count, size).T, parameters).ravel()[order]
+                return(matrix)
+
+        # solve_ivp controls the RMS error over all components, so tolerances shrink with the batch size to keep
+        # each point's error within the single-point tolerances.
+        scale = np.sqrt(count)
+        if targets:
+            times = np.arange(self.duration + 1, dtype=float)
+        else:
+            times = np.unique(np.array(steps, dtype=float))
+        with phases.Phase("integration"):
+            solution = solve_ivp(derivatives, (0.0, times[-1]), states.T.ravel(), method=self.method, t_eval=times,
+                                 rtol=self.rtol / scale, atol=self.atol / scale, jac=jacobian, **options)
+        CountSolver(solution)
+        if not solution.success:
+            raise SimulationError("Error. Running the time course simulation failed.\n" + solution.message + "\n")
+        results = []
+        for k in range(count):
+            trajectory = np.vstack((solution.t, solution.y[k*size:(k+1)*size])).T
+            if targets:
+                with open(targets[k], "w+") as ofn:
+                    ofn.write(", ".join(["time"] + self.speciesids) + "\n")
+                    for row in trajectory:
+                        ofn.write(", ".join([str(float(x)) for x in row]) + "\n")
+            results.append(trajectory[np.searchsorted(times, steps)])
+        return(results)
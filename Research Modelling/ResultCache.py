@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+import numpy as np
+import hashlib
+import os
+
+def _Canonical(value):
+    """Writes a key component as a string that does not depend on float noise: floats are rounded to 12 significant
+    figures, so 0.30000000000000004 and 0.3 share a key."""
+    if isinstance(value, float):
+        return("%.12g" % value)
+    if isinstance(value, (list, tuple)):
+        return("(" + ",".join([_Canonical(x) for x in value]) + ")")
+    return(repr(value))
+
+def _Replace(source, target):
+    """Moves file 'source' over 'target' in one step, so a reader sees either the old or the new file. Python 2 has no
+    os.replace; there os.rename replaces on POSIX, while Windows needs the target removed first."""
+    if hasattr(os, "replace"):
+        os.replace(source, target)
+        return
+    if os.name == "nt" and os.path.exists(target):
+        os.remove(target)
+    os.rename(source, target)
+
+class ResultCache(object):
+    """Persistent on-disk cache of sweep point results, keyed on a hash of everything that determines them: the SBML
+    file contents, the engine & its solver settings, the model changes, duration, mode and kept steps. Each entry is
+    one .npy file in 'directory'. Entries are evicted least recently used first once the directory holds more than
+    'limit' bytes, down to 'low' of the limit, so the directory is only rescanned after many new entries; a hit
+    refreshes the entry's modification time."""
+
+    def __init__(self, directory, limit=100*1024*1024, low=0.9):
+        self.directory = directory
+        self.limit = limit
+        self.low = low
+        self.filehashes = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Running total of the entries' sizes, kept up to date by Put and recounted by Evict.
+        self.total = self.Evict()
+
+    def FileHash(self, filename):
+        "Returns the SHA-1 of a file's contents, read once per cache object."
+        if filename not in self.filehashes:
+            with open(filename, "rb") as mfn:
+                self.filehashes[filename] = hashlib.sha1(mfn.read()).hexdigest()
+        return(self.filehashes[filename])
+
+    def Key(self, session, sessionargs, setup, overrides, steps, settings):
+        """Returns the cache key of one sweep point. 'session' is a loaded session of the sweep's engine, whose name,
+        solver and current tolerances are part of the key. 'sessionargs' starts with the model filename, whose
+        contents are hashed; the remaining arguments are part of the key, with the mode, settle & ensemble settings
+        of the sweep's SweepSettings."""
+        parts = [self.FileHash(sessionargs[0]), session.name, session.solver, list(session.GetTolerances()),
+                 list(sessionargs[1:]), list(setup), list(overrides), list(steps), settings.mode, settings.settle,
+                 settings.ensemble]
+        return(hashlib.sha1(_Canonical(parts).encode("utf-8")).hexdigest())
+
+    def Get(self, key):
+        "Returns the cached rows for 'key', or None on a miss. An entry that cannot be read is removed as a miss."
+        path = os.path.join(self.directory, key + ".npy")
+        if not os.path.exists(path):
+            return(None)
+        try:
+            rows = np.load(path)
+        except (IOError, ValueError):
+            # A damaged entry, e.g. cut short by a full disk, is simulated again and rewritten.
+            self.total = self.total - os.path.getsize(path)
+            os.remove(path)
+            return(None)
+        os.utime(path, None)
+        return(rows)
+
+    def Put(self, key, rows):
+        "Stores the rows for 'key', then evicts the least recently used entries beyond the size limit."
+        path = os.path.join(self.directory, key + ".npy")
+        np.save(path + ".tmp.npy", np.asarray(rows))
+        # Written under a temporary name first, then moved into place in one step, so a reader never sees half an
+        # entry or none while it is replaced.
+        if os.path.exists(path):
+            self.total = self.total - os.path.getsize(path)
+        _Replace(path + ".tmp.npy", path)
+        self.total = self.total + os.path.getsize(path)
+        if self.total > self.limit:
+            self.total = self.Evict()
+
+    def Evict(self):
+        """Recounts the entries and, if they exceed the size limit, removes the least recently used until they fit
+        within 'low' of it. Output: the total size of the entries kept, in bytes."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy") and not name.endswith(".tmp.npy"):
+                path = os.path.join(self.directory, name)
+                status = os.stat(path)
+                entries.append((status.st_mtime, path, status.st_size))
+                total = total + status.st_size
+        if total <= self.limit:
+            return(total)
+        entries.sort()
+        for mtime, path, size in entries:
+            if total <= self.low * self.limit:
+                break
+            os.remove(path)
+            total = total - size
+        return(total)
+
+def CacheOption(options):
+    """Returns a ResultCache for the '--cache' directory option, or None. '--cache-size' is the size limit in MB.
+    Default: 100."""
+    if "cache" not in options:
+        return(None)
+    return(ResultCache(options["cache"], int(float(options.get("cache-size", 100)) * 1024 * 1024)))
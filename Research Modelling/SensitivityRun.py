@@ -0,0 +1,112 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+from SweepTools import *
+from MassActionModel import MassActionSession
+import numpy as np
+import sys
+
+def Scaled(sensitivities, outputs, values):
+    """Scales sensitivities d output / d parameter by parameter value over output value, so that each is the relative
+    change in the output per relative change in the parameter. Outputs at zero give nan.
+    Arguments: 'sensitivities' is outputs x parameters. 'outputs' & 'values' are the output & parameter values."""
+    outputs = np.asarray(outputs, dtype=float)[:, np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scaled = sensitivities * np.asarray(values, dtype=float)[np.newaxis, :] / outputs
+    scaled[outputs[:, 0] == 0, :] = np.nan
+    return(scaled)
+
+def main(args):
+    """Function to compute the local sensitivities of chosen species to every reaction parameter of a model, in one
+    pass, instead of one ParameterRun.py sweep per parameter.
+    Arguments: 'filename' is a string pointing to the model file in XML (SBML) format in the local directory.
+    'duration' is the time course duration in seconds. Default = 50000. 'inputname' is the input species, set to
+    'inputconc' mmol/ml before the run, as for ParameterRun.py. Defaults: inducer_1 at 0.005. Any further arguments
+    are the output species. Default: every species.
+    Options: '--mode steady-state' gives steady-state sensitivities; the default, time-course, gives them at the end of
+    the time course. '--parameters' is a comma-separated list of parameters as reaction.parameter. Default: every
+    reaction parameter.
+    Sensitivities come from the forward sensitivity equations with the analytic Jacobian of MassActionModel.py, or, at
+    steady state, from one linear solve; the COPASI bindings are not needed.
+    Output: Sensitivity_(filename)_output.txt, ranked by the size of the scaled sensitivity for each output.
+    """
+
+    # Options are separated from the positional arguments first.
+    args, options = SplitOptions(args)
+    mode = SweepMode(options)
+
+    # 'args' is fed to the main function as a tuple. Defining variables & ensuring type is correct.
+    filename = str(args[0])
+
+    try:
+        duration = int(args[1])
+    except IndexError:
+        duration = 50000
+
+    try:
+        inputname = str(args[2])
+    except IndexError:
+        inputname = "inducer_1"
+
+    try:
+        inputconc = float(args[3])
+    except IndexError:
+        inputconc = 0.005
+
+    outputnames = [str(name) for name in args[4:]]
+
+    # Housekeeping.
+    assert isinstance(filename, str)
+    assert isinstance(duration, int)
+    if mode == "stochastic":
+        sys.stderr.write("Error. Sensitivities need --mode time-course or steady-state.\n")
+        return 1
+
+    # Loading the model & setting the input species.
+    session = MassActionSession(filename, duration)
+    network = session.network
+    ApplyOverrides(session, [("species", inputname, inputconc)])
+    if not outputnames:
+        outputnames = list(session.speciesids)
+    outputs = [network.SpeciesIndex(name) for name in outputnames]
+    if "parameters" in options:
+        parameterids = options["parameters"].split(",")
+    else:
+        parameterids = [parameterid for parameterid in network.parameterids if "." in parameterid]
+    for parameterid in parameterids:
+        if parameterid not in network.parameterindex:
+            sys.stderr.write("Error. No reaction parameter " + parameterid + " in " + filename + "\n")
+            return 1
+
+    print("Running {} sensitivities of {} species to {} parameters.".format(mode, len(outputs), len(parameterids)))
+    try:
+        rows, sensitivities = session.RunSensitivities(parameterids, mode == "steady-state")
+    except SimulationError as error:
+        sys.stderr.write(str(error))
+        return 1
+    if mode == "steady-state" and not np.isinf(rows[0, 0]):
+        sys.stderr.write("Warning. No steady state found; sensitivities are at the end of the time course.\n")
+
+    # Ranked table. Outputs keep the order given; within each, parameters are ranked by |scaled sensitivity|.
+    values = session.parameters[[network.parameterindex[parameterid] for parameterid in parameterids]]
+    final = rows[0, 1:]
+    scaled = Scaled(sensitivities[outputs], final[outputs], values)
+    sensitivityfilename = "Sensitivity_" + filename[:-4] + "_output.txt"
+    with open(sensitivityfilename, "w+") as sfn:
+        sfn.write(", ".join(["rank", "output", "parameter", "value", "output_value", "sensitivity",
+                             "scaled_sensitivity"]) + "\n")
+        for o in range(len(outputs)):
+            order = sorted(range(len(parameterids)),
+                           key=lambda k: -np.abs(scaled[o, k]) if not np.isnan(scaled[o, k]) else 0.0)
+            for rank in range(len(order)):
+                k = order[rank]
+                line = [rank + 1, outputnames[o], parameterids[k], values[k], final[outputs[o]],
+                        sensitivities[outputs[o], k], scaled[o, k]]
+                sfn.write(" ".join([str(x) for x in line]) + "\n")
+            print("{}: most sensitive to {} (scaled sensitivity {:.3g}).".format(outputnames[o], parameterids[order[0]],
+                                                                               scaled[o, order[0]]))
+    print("{} sensitivities written to {}.".format(len(outputs) * len(parameterids), sensitivityfilename))
+
+if (__name__ == '__main__'):
+    main(sys.argv[1:])
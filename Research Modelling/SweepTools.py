@@ -0,0 +1,916 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+from ResultCache import CacheOption
+import numpy as np
+import copy
+import multiprocessing
+import contextlib
+import cProfile
+import time
+import os
+import sys
+
+class SimulationError(Exception):
+    "Raised when a simulation fails. The message holds any solver or COPASI message text."
+    pass
+
+class RetriedRows(np.ndarray):
+    """Rows of a sweep point that only succeeded when retried with tightened tolerances. They are not what the
+    session's solver settings give, so they are kept out of the result cache."""
+    pass
+
+class PhaseTimer(object):
+    """Accumulates wall time and call counts per named phase of a run, e.g. "model load" or "integration", and
+    solver statistics as named counters. One timer, 'phases', is shared by the sessions and scripts of each process.
+    With timing on, RunSweep also keeps a record per sweep point in 'points'."""
+
+    def __init__(self):
+        self.Reset()
+
+    def Reset(self):
+        self.totals = {}
+        self.counts = {}
+        self.counters = {}
+        self.points = []
+
+    def Add(self, phase, seconds):
+        self.totals[phase] = self.totals.get(phase, 0.0) + seconds
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def Count(self, counter, amount=1):
+        "Adds to a solver statistic, e.g. function evaluations."
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def Snapshot(self):
+        "Returns a copy of the phase times, call counts & counters so far."
+        return({"totals": dict(self.totals), "counts": dict(self.counts), "counters": dict(self.counters)})
+
+    def Since(self, snapshot):
+        "Returns what has been added since 'snapshot', laid out as a snapshot. A snapshot of None is the start."
+        delta = self.Snapshot()
+        if snapshot is not None:
+            for part in delta:
+                for name in delta[part]:
+                    delta[part][name] = delta[part][name] - snapshot[part].get(name, 0)
+        return(delta)
+
+    def Merge(self, delta):
+        "Adds the phase times, call counts & counters of another process, as returned by Since."
+        for name in delta["totals"]:
+            self.totals[name] = self.totals.get(name, 0.0) + delta["totals"][name]
+            self.counts[name] = self.counts.get(name, 0) + delta["counts"][name]
+        for name in delta["counters"]:
+            self.Count(name, delta["counters"][name])
+
+    def Summary(self, wall, points):
+        """Returns the timing summary of a run as text: wall time & points per second, then time, share & calls of
+        each phase, longest first, and the solver statistics. Phases are summed over worker processes."""
+        lines = ["Timing summary: {:.3f} s wall, {} points, {:.3f} points/s.".format(wall, points,
+                                                                                  points / max(wall, 1e-9))]
+        other = wall - sum(self.totals.values())
+        names = sorted(self.totals, key=lambda name: -self.totals[name])
+        for name in names:
+            lines.append("  {:<16} {:>10.3f} s {:>6.1%} {:>8} calls".format(name, self.totals[name],
+                                                                         self.totals[name] / max(wall, 1e-9),
+                                                                         self.counts[name]))
+        if other > 0:
+            lines.append("  {:<16} {:>10.3f} s {:>6.1%}".format("other", other, other / max(wall, 1e-9)))
+        for name in sorted(self.counters):
+            lines.append("  {:<24} {:>10}".format(name, self.counters[name]))
+        return("\n".join(lines))
+
+    def WritePoints(self, filename):
+        """Writes the per-point records as a table: point number from 1, number of points (more than 1 for a batch),
+        wall seconds, then seconds per phase & each solver statistic."""
+        phasenames = sorted(set([name for record in self.points for name in record["totals"]]))
+        counternames = sorted(set([name for record in self.points for name in record["counters"]]))
+        with open(filename, "w+") as tfn:
+            tfn.write(", ".join(["point", "points", "seconds"] + phasenames + counternames) + "\n")
+            for record in self.points:
+                line = [record["point"] + 1, record["points"], "%.6f" % record["seconds"]]
+                line = line + ["%.6f" % record["totals"].get(name, 0.0) for name in phasenames]
+                line = line + [record["counters"].get(name, 0) for name in counternames]
+                tfn.write(" ".join([str(x) for x in line]) + "\n")
+
+    @contextlib.contextmanager
+    def Phase(self, phase):
+        "Context manager timing the code inside it as one call of 'phase'."
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.Add(phase, time.time() - start)
+
+# Phase timer of the current process.
+phases = PhaseTimer()
+
+# Phase timer snapshot at the last time this process reported its timings, for _TimedJob.
+_reported = None
+
+def _TimedJob(job):
+    """Runs ('function', 'job') and returns the result with two timing records: the phase times & counters of this
+    job, plus its wall time, and everything this process has timed since it last reported, including a worker's
+    model load. The second lets the main process add up the timings of its workers."""
+    global _reported
+    function, job = job
+    before = phases.Snapshot()
+    start = time.time()
+    result = function(job)
+    record = phases.Since(before)
+    record["seconds"] = time.time() - start
+    delta = phases.Since(_reported)
+    _reported = phases.Snapshot()
+    return((result, record, delta))
+
+def WriteTiming(start, count, adaptive, timingfilename):
+    """Prints the phase summary of a run script's sweep of 'count' values, started at time 'start', and writes the
+    time & solver statistics of each point to 'timingfilename'. Adaptive sweeps number the points of the timing
+    file in the order they were simulated."""
+    if adaptive is not None:
+        done = 0
+        for record in phases.points:
+            record["point"] = done
+            done = done + record["points"]
+    phases.WritePoints(timingfilename)
+    print(phases.Summary(time.time() - start, count))
+    print("Per-point timings written to {}.".format(timingfilename))
+
+def Profiled(function, args, filename):
+    """Runs function(args) under cProfile and writes the profile to 'filename', for pstats or a profile viewer.
+    Only the calling process is profiled. Output: what 'function' returns."""
+    profiler = cProfile.Profile()
+    try:
+        return(profiler.runcall(function, args))
+    finally:
+        profiler.dump_stats(filename)
+
+def SplitOptions(args, flags=()):
+    """SplitOptions function. Separates '--name value' options from the positional arguments given to a script.
+    Arguments: 'args' is the argument list, 'flags' lists option names that take no value. Output: tuple of the
+    positional argument list and a dictionary of options."""
+    positional = []
+    options = {}
+    i = 0
+    while i < len(args):
+        arg = str(args[i])
+        if arg.startswith("--"):
+            name = arg[2:]
+            if name in flags:
+                options[name] = True
+            else:
+                options[name] = str(args[i+1])
+                i = i + 1
+        else:
+            positional.append(arg)
+        i = i + 1
+    return(positional, options)
+
+def EngineClass(options):
+    """Returns the session class for the '--engine' option: 'copasi' (default), 'numpy', or 'batch' for the numpy
+    engine integrating the whole sweep as one system. Engines are imported here, so the numpy engines run without
+    the COPASI bindings installed."""
+    engine = options.get("engine", "copasi")
+    if engine == "copasi":
+        from CopasiSession import CopasiSession
+        return(CopasiSession)
+    if engine == "numpy":
+        from MassActionModel import MassActionSession
+        return(MassActionSession)
+    if engine == "batch":
+        from MassActionModel import BatchSession
+        return(BatchSession)
+    raise ValueError("Unknown engine: " + engine)
+
+def SweepMode(options):
+    """Returns the simulation mode from the '--mode' option: 'time-course' (default), 'steady-state' or
+    'stochastic', an ensemble of stochastic time courses per point."""
+    mode = options.get("mode", "time-course")
+    if mode not in ("time-course", "steady-state", "stochastic"):
+        raise ValueError("Unknown mode: " + mode)
+    return(mode)
+
+def FormatOption(options):
+    """Returns the parsed results format from the '--format' option: 'text' (default), the space-separated parsed
+    file, or 'columns', a binary column store written by ColumnStore.py."""
+    fileformat = options.get("format", "text")
+    if fileformat not in ("text", "columns"):
+        raise ValueError("Unknown format: " + fileformat)
+    return(fileformat)
+
+def SettleOptions(options):
+    """Returns the early termination settings as a (window, rtol, atol) tuple, or None when '--settle' is not given.
+    '--settle' is the window in seconds, at least 2, from which the change still to come before the end of the time
+    course is estimated, as in SettledSince. '--settle-rtol' and '--settle-atol' bound that change, as
+    rtol * |concentration| + atol in mmol/ml. Defaults: 1e-4 and 1e-12. The state kept is then typically within
+    rtol of the state at the full duration: within 1.4e-4 for every bundled model with windows of 100 s or more,
+    except ModelS2-2 at 1e-6 mmol/ml inducer, whose slow late phase a 100 s window misses (0.13%; 1000 s: 9e-5)."""
+    if "settle" not in options:
+        return(None)
+    window = int(options["settle"])
+    assert window >= 2
+    rtol = float(options.get("settle-rtol", 1.0e-4))
+    atol = float(options.get("settle-atol", 1.0e-12))
+    return((window, rtol, atol))
+
+def EnsembleOptions(options):
+    """Returns the stochastic ensemble settings as a (size, seed, quantiles, epsilon, critical, separation) tuple, the
+    arguments of RunEnsemble after the steps. '--ensemble' is the number of trajectories per sweep point. Default: 1000.
+    '--seed' seeds the random numbers. Default: 0. '--quantiles' is a comma-separated list of quantiles to report,
+    between 0 and 1. Default: 0.05,0.5,0.95. '--leap-epsilon' is the largest relative change of a propensity a
+    tau-leap may make. Default: 0.03. '--critical' is the number of firings' worth of copies of a species below which
+    the reaction channels that change it are critical, firing at most once per leap. Default: 10. '--separation' is
+    how many times faster than the channels around it a reversible reaction of critical channels must be to be taken
+    at equilibrium, 0 for never. Default: 10."""
+    size = int(options.get("ensemble", 1000))
+    assert size >= 2
+    seed = int(options.get("seed", 0))
+    quantiles = [float(q) for q in options.get("quantiles", "0.05,0.5,0.95").split(",")]
+    for q in quantiles:
+        assert 0.0 <= q <= 1.0
+    epsilon = float(options.get("leap-epsilon", 0.03))
+    assert 0.0 < epsilon < 1.0
+    critical = int(options.get("critical", 10))
+    assert critical >= 0
+    separation = float(options.get("separation", 10.0))
+    assert separation >= 0.0
+    return((size, seed, quantiles, epsilon, critical, separation))
+
+def EnsembleColumns(speciesids, quantiles):
+    """Returns the column names of stochastic ensemble rows: time, the mean of each species under its own name, then
+    each species' variance, then each species at each quantile, e.g. GFP_q0.95."""
+    columns = ["time"] + list(speciesids) + [speciesid + "_var" for speciesid in speciesids]
+    for q in quantiles:
+        columns = columns + [speciesid + "_q" + str(q) for speciesid in speciesids]
+    return(columns)
+
+def EnsembleRows(times, samples, quantiles):
+    """Summarises an ensemble of stochastic time courses. 'samples' holds the species concentrations of every
+    trajectory at each of 'times', as times x trajectories x species. Output: array with one row per time, laid out
+    as EnsembleColumns names."""
+    parts = [np.asarray(times)[:, np.newaxis], samples.mean(axis=1), samples.var(axis=1, ddof=1)]
+    parts = parts + [np.percentile(samples, 100.0 * q, axis=1) for q in quantiles]
+    return(np.hstack(parts))
+
+def SettledSince(rows, rtol, atol, left):
+    """SettledSince function. Checks whether every species has settled over a run of time course rows (time, then
+    species), to within rtol * |concentration| + atol of where it will be after 'left' more seconds. The change over
+    the second half of the rows, and its ratio to the change over the first half, extrapolate the approach to steady
+    state as a geometric series over the half-windows left: a decaying change sums to its remaining approach, one
+    that does not decay is taken as a steady drift, and one that changes sign as a swing about the steady state, no
+    larger than its last half. Changes between halves rather than between rows keep solver noise out of the test.
+    Output: True or False."""
+    x = rows[:, 1:]
+    half = (len(rows) - 1) // 2
+    first = x[half] - x[0]
+    last = x[-1] - x[half]
+    periods = left / (rows[-1, 0] - rows[half, 0])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(first != 0, last / first, np.where(last != 0, np.inf, 0.0))
+        decay = np.clip(ratio, 0.0, 1.0)
+        series = np.where(decay < 1, decay * (1 - decay ** periods) / np.maximum(1 - decay, 1e-300), periods)
+    remaining = np.abs(last) * np.where(ratio < 0, 1.0, series)
+    return(bool(np.all(remaining <= rtol * np.abs(x[-1]) + atol)))
+
+def SweepValues(minimum, maximum, count, spacing="lin"):
+    """Returns 'count' sweep values from 'minimum' to 'maximum'. 'spacing' is "lin" for even steps, as the run
+    scripts have always used, or "log" for even steps in log10, which needs a positive minimum."""
+    if count == 1:
+        return([float(minimum)])
+    if spacing == "lin":
+        return([minimum + (float(n)/float(count-1)) * (float(maximum) - float(minimum)) for n in range(count)])
+    if spacing == "log":
+        assert minimum > 0 and maximum > 0
+        return([float(x) for x in np.logspace(np.log10(minimum), np.log10(maximum), count)])
+    raise ValueError("Unknown spacing: " + spacing)
+
+def AxisParser(spec):
+    """AxisParser function. Reads one grid axis from a colon-separated specification:
+    species:<name>:<lin|log>:<min>:<max>:<count> or species:<name>:list:<value>,<value>,... for an initial
+    concentration, and parameter:<reaction>:<parameter>:<lin|log|list>:... for a reaction parameter.
+    Output: tuple of the axis label, a function building the model change for a value, and the axis values."""
+    fields = spec.split(":")
+    if fields[0] == "species":
+        label = fields[1]
+        change = lambda value, name=fields[1]: ("species", name, value)
+        fields = fields[2:]
+    elif fields[0] == "parameter":
+        label = fields[1] + "." + fields[2]
+        change = lambda value, reaction=fields[1], parameter=fields[2]: ("parameter", reaction, parameter, value)
+        fields = fields[3:]
+    else:
+        raise ValueError("Axis must start with species or parameter: " + spec)
+    if fields[0] == "list":
+        values = [float(x) for x in fields[1].split(",")]
+    else:
+        values = SweepValues(float(fields[1]), float(fields[2]), int(fields[3]), fields[0])
+    return((label, change, values))
+
+def AdaptiveOptions(options, iterations):
+    """Returns the adaptive refinement settings as a (budget, tolerance, outputname) tuple, or None when '--adaptive'
+    is not given. '--budget' is the most points to simulate in total. Default: 4 x iterations. '--tolerance' is the
+    largest change allowed across an interval, as a fraction of the output's range. Default: 0.05. '--output' is the
+    species that drives refinement. Default: every species."""
+    if "adaptive" not in options:
+        return(None)
+    budget = int(options.get("budget", 4 * iterations))
+    tolerance = float(options.get("tolerance", 0.05))
+    return((budget, tolerance, options.get("output")))
+
+def AdaptiveSweep(evaluate, values, spacing, budget, tolerance, columns):
+    """AdaptiveSweep function. Samples a response curve where it changes most. Starting from the coarse 'values',
+    every interval whose output change or curvature exceeds 'tolerance' (as a fraction of the output range) is
+    bisected, worst first, until no interval exceeds it or 'budget' points have been simulated.
+    Arguments: 'evaluate' simulates a list of values and returns their row arrays. 'spacing' is "lin" or "log",
+    and sets whether intervals are bisected arithmetically or geometrically. 'columns' lists the row columns that
+    drive refinement. Output: tuple of the sorted values & their row arrays."""
+    values = sorted(values)
+    results = list(evaluate(values))
+    while len(values) < budget:
+        outputs = np.array([rows[-1][columns] for rows in results])
+        scale = outputs.max(axis=0) - outputs.min(axis=0)
+        scale[scale == 0] = 1.0
+        changes = np.abs(np.diff(outputs, axis=0)) / scale
+        scores = changes.max(axis=1)
+        # Curvature at each interior point counts against both of its intervals.
+        if len(values) > 2:
+            curvature = (np.abs(np.diff(np.diff(outputs, axis=0), axis=0)) / scale).max(axis=1)
+            scores[:-1] = np.maximum(scores[:-1], curvature)
+            scores[1:] = np.maximum(scores[1:], curvature)
+        worst = [i for i in np.argsort(-scores) if scores[i] > tolerance][:budget - len(values)]
+        if not worst:
+            break
+        if spacing == "log":
+            midpoints = [float(np.sqrt(values[i] * values[i+1])) for i in worst]
+        else:
+            midpoints = [0.5 * (values[i] + values[i+1]) for i in worst]
+        print("Adaptive sampling: refining {} intervals.".format(len(midpoints)))
+        newresults = evaluate(midpoints)
+        order = np.argsort(values + midpoints, kind="mergesort")
+        values = [(values + midpoints)[i] for i in order]
+        results = [(results + list(newresults))[i] for i in order]
+    return((values, results))
+
+def TimeSteps(options, duration):
+    """Returns the time course step numbers to keep, from the comma-separated '--times' option. Step size is one
+    second so a time in seconds is also its step number. Default: the final step only."""
+    try:
+        steps = [int(round(float(t))) for t in options["times"].split(",")]
+    except KeyError:
+        steps = [duration]
+    for step in steps:
+        assert 0 <= step <= duration
+    return(steps)
+
+def TimeSeriesRows(timeSeries, dataModel, speciesids, steps):
+    """TimeSeriesRows function. Reads selected steps of a COPASI time series straight into an array laid out as the
+    report body: time, then species concentrations in 'speciesids' order. Output: array of shape
+    (len(steps), len(speciesids)+1)."""
+    # Time series variables follow the model state order, not the metabolite order used by the report.
+    columns = {}
+    for i in range(1, timeSeries.getNumVariables()):
+        columns[timeSeries.getSBMLId(i, dataModel)] = i
+    rows = np.empty((len(steps), len(speciesids) + 1))
+    for r in range(len(steps)):
+        rows[r, 0] = timeSeries.getData(steps[r], 0)
+        for c in range(len(speciesids)):
+            rows[r, c+1] = timeSeries.getConcentrationData(steps[r], columns[speciesids[c]])
+    return(rows)
+
+def ApplyOverrides(session, overrides):
+    """Applies a list of model changes to a session. Each change is either ("species", speciesname, value) for an
+    initial concentration or ("parameter", reactionname, parametername, value) for a reaction parameter."""
+    for change in overrides:
+        if change[0] == "species":
+            session.SetSpecies(change[1], change[2])
+        elif change[0] == "parameter":
+            session.SetParameter(change[1], change[2], change[3])
+        else:
+            raise ValueError("Unknown model change: " + str(change[0]))
+
+# Session held by each worker process, loaded once by _StartWorker.
+_session = None
+
+def _StartWorker(sessionclass, sessionargs, setup):
+    "Pool initialiser. Loads the model once for this worker process."
+    global _session
+    _session = sessionclass(*sessionargs)
+    ApplyOverrides(_session, setup)
+
+def _StartPoolWorker(sessionclass, sessionargs, setup):
+    "Pool initialiser. Starts this worker's phase timer afresh, then loads the model once."
+    global _reported
+    phases.Reset()
+    _reported = None
+    _StartWorker(sessionclass, sessionargs, setup)
+
+def _UseSession(sessionclass, sessionargs, setup, session):
+    "Sets up the session of the current process for a serial run, reusing 'session' if one is already loaded."
+    global _session
+    if session is None:
+        _StartWorker(sessionclass, sessionargs, setup)
+    else:
+        _session = session
+        ApplyOverrides(_session, setup)
+
+def _RunJob(job):
+    "Simulates one sweep point against the session of the current process."
+    message, overrides, steps, target, mode, settle, ensemble = job
+    if message:
+        print(message)
+    ApplyOverrides(_session, overrides)
+    if mode == "steady-state":
+        return(_session.RunSteadyState())
+    if mode == "stochastic":
+        return(_session.RunEnsemble(steps, *ensemble))
+    if settle is not None:
+        return(_session.RunSettled(*settle))
+    return(_session.Run(steps, target))
+
+def _RunBatchJob(job):
+    "Simulates a contiguous block of sweep points as one batch against the session of the current process."
+    messages, overridelist, steps, targets = job
+    for message in messages:
+        if message:
+            print(message)
+    return(_session.RunBatch(overridelist, steps, targets))
+
+def _RunCheckedJob(job):
+    """Simulates one sweep point as _RunJob does, but returns a failure as its SimulationError instead of raising it.
+    If 'retry' is set, a failed point is run once more with both solver tolerances divided by 'retry'."""
+    job, retry = job
+    try:
+        return(_RunJob(job))
+    except SimulationError as error:
+        if retry is None:
+            phases.Count("failed points")
+            return(error)
+        sys.stderr.write("Warning. Sweep point failed; retrying with tolerances tightened {}-fold.\n".format(retry))
+    phases.Count("retries")
+    rtol, atol = _session.GetTolerances()
+    _session.SetTolerances(rtol / retry, atol / retry)
+    try:
+        return(np.asarray(_RunJob(("",) + job[1:])).view(RetriedRows))
+    except SimulationError as error:
+        phases.Count("failed points")
+        return(error)
+    finally:
+        _session.SetTolerances(rtol, atol)
+
+def _RunCheckedBatchJob(job):
+    """Simulates a block of sweep points as _RunBatchJob does. If the batch fails, its points are run one at a time
+    as _RunCheckedJob does, so only the failing points are lost."""
+    batch, retry = job
+    try:
+        return(_RunBatchJob(batch))
+    except SimulationError:
+        messages, overridelist, steps, targets = batch
+        targets = targets or [""] * len(overridelist)
+        return([_RunCheckedJob((("", overridelist[n], steps, targets[n], "time-course", None, None), retry))
+                for n in range(len(overridelist))])
+
+def _PoolMap(function, jobs, workers, sessionclass, sessionargs, setup, collect):
+    """Maps jobs over a pool of worker processes, each loading the model once. Results keep the order of the jobs and
+    are passed to 'collect' with their job number as they arrive."""
+    pool = multiprocessing.Pool(workers, _StartPoolWorker, (sessionclass, sessionargs, setup))
+    try:
+        results = []
+        for result in pool.imap(function, jobs, chunksize=1):
+            results.append(collect(len(results), result))
+        return(results)
+    finally:
+        pool.close()
+        pool.join()
+
+class SweepSettings(object):
+    """How RunSweep & RunModels run the points of a sweep.
+    Arguments: 'workers' is the number of worker processes. 'mode' is "time-course", "steady-state" or "stochastic".
+    'settle' is the SettleOptions tuple for time courses that stop once steady, or None. 'ensemble' is the
+    EnsembleOptions tuple of stochastic sweeps. 'warm' starts each point from the final state of the point before
+    (continuation), which needs a serial run. 'cache' is a ResultCache: points found there are not simulated, and new
+    results are added to it. 'keepgoing' returns a failing point's SimulationError in place of its rows instead of
+    stopping the sweep; 'retry' then runs failed points once more with tolerances divided by 'retry', and their
+    RetriedRows are not cached. 'timing' keeps a record of phase times & solver statistics per point in
+    'phases.points', and adds the timings of worker processes to this process's 'phases'."""
+
+    def __init__(self, workers=1, mode="time-course", settle=None, ensemble=None, warm=False, cache=None,
+                 keepgoing=False, retry=None, timing=False):
+        self.workers = workers
+        self.mode = mode
+        self.settle = settle
+        self.ensemble = ensemble
+        self.warm = warm
+        self.cache = cache
+        self.keepgoing = keepgoing
+        self.retry = retry
+        self.timing = timing
+
+    def Copy(self, **changes):
+        "Returns a copy of the settings with the attributes named changed."
+        settings = copy.copy(self)
+        settings.__dict__.update(changes)
+        return(settings)
+
+def RunSweep(sessionclass, sessionargs, setup, points, steps, settings=None, session=None, targets=None, store=None,
+             onpoint=None, previous=None):
+    """RunSweep function. Simulates a list of sweep points, serially or over a process pool.
+    Arguments: 'sessionclass' & 'sessionargs' build the model session, once per process. 'setup' is a list of model
+    changes applied once after loading. 'points' is a list of (message, overrides) pairs in sweep order. 'steps' lists
+    the time course steps to keep. 'settings' is the SweepSettings; default: a plain serial time course sweep.
+    'session' is an already loaded session, used by serial runs. 'targets' optionally gives a paging file per point.
+    Continuation and paging files bypass the cache. Batch sessions run plain time courses as one system per process,
+    each worker taking a contiguous block of points. 'store' is a TrajectoryWriter: each point also records the
+    store's steps, which are written to it as soon as the point is done. Time courses only; the cache is bypassed.
+    'onpoint' is called with the point number, result & final state row of each point as it is done, in sweep
+    order, e.g. to checkpoint it; the final state is None unless the sweep is warm-started. Warm-started time
+    courses always run to the full duration, whatever steps are kept, and the next point starts from that final
+    state. 'previous' gives the final state row of the point before the first, for continuing a resumed warm-start
+    sweep.
+    Output: list of row arrays in sweep order, whatever the number of workers."""
+    if settings is None:
+        settings = SweepSettings()
+    workers, mode, settle, ensemble = settings.workers, settings.mode, settings.settle, settings.ensemble
+    warm, cache, keepgoing, retry, timing = (settings.warm, settings.cache, settings.keepgoing, settings.retry,
+                                             settings.timing)
+    if targets is None:
+        targets = [""] * len(points)
+    if cache is not None and not warm and not any(targets) and store is None:
+        # The key holds the session's tolerances, so a session is loaded here if none was given; serial runs reuse it.
+        if session is None:
+            session = sessionclass(*sessionargs)
+        keys = [cache.Key(session, sessionargs, setup, point[1], steps, settings) for point in points]
+        results = [cache.Get(key) for key in keys]
+        missing = [n for n in range(len(points)) if results[n] is None]
+        print("{} of {} sweep points found in the cache.".format(len(points) - len(missing), len(points)))
+        if onpoint is not None:
+            for n in range(len(points)):
+                if results[n] is not None:
+                    onpoint(n, results[n], None)
+        if missing:
+            onmissing = None if onpoint is None else lambda n, rows, final: onpoint(missing[n], rows, final)
+            records = len(phases.points)
+            simulated = RunSweep(sessionclass, sessionargs, setup, [points[n] for n in missing], steps,
+                                 settings.Copy(cache=None), session, onpoint=onmissing)
+            for record in phases.points[records:]:
+                record["point"] = missing[record["point"]]
+            for n, rows in zip(missing, simulated):
+                if not isinstance(rows, (SimulationError, RetriedRows)):
+                    cache.Put(keys[n], rows)
+                results[n] = rows
+        return(results)
+    # With a trajectory store, the kept and recorded steps are run together and split as each point comes back.
+    # Continuation runs time courses to their last step too, kept or not, to start the next point from it.
+    runsteps = steps
+    if store is not None:
+        runsteps = sorted(set(steps) | set(store.steps))
+    if warm and mode == "time-course" and settle is None:
+        # Continuation is serial, so the session is set up here to read its duration, and reused below.
+        _UseSession(sessionclass, sessionargs, setup, session)
+        session = _session
+        runsteps = sorted(set(runsteps) | set([session.duration]))
+    position = dict((runsteps[i], i) for i in range(len(runsteps)))
+    kept = [position[step] for step in steps]
+    recorded = [position[step] for step in store.steps] if store is not None else None
+    # Final state row of each point collected, for continuation.
+    finals = {}
+    def collect(n, rows):
+        if not isinstance(rows, SimulationError):
+            if warm:
+                finals[n] = rows[-1]
+            if store is not None:
+                store.Write(n, rows[recorded])
+            if runsteps is not steps:
+                rows = rows[kept]
+        if onpoint is not None:
+            onpoint(n, rows, finals.get(n))
+        return(rows)
+    jobs = [(points[n][0], points[n][1], runsteps, targets[n], mode, settle, ensemble) for n in range(len(points))]
+    runjob, runbatchjob = _RunJob, _RunBatchJob
+    if keepgoing:
+        jobs = [(job, retry) for job in jobs]
+        runjob, runbatchjob = _RunCheckedJob, _RunCheckedBatchJob
+    if timing:
+        jobs = [(runjob, job) for job in jobs]
+        runjob = _TimedJob
+    def Timed(n, result, count, pooled):
+        # Unpacks a timed job's result, keeping its record; the timings of pool workers are added to this process's.
+        if not timing:
+            return(result)
+        result, record, delta = result
+        if pooled:
+            phases.Merge(delta)
+        record["point"] = n
+        record["points"] = count
+        phases.points.append(record)
+        return(result)
+    if getattr(sessionclass, "batch", False) and mode == "time-course" and settle is None and not warm:
+        blocks = [(n * len(points)) // workers for n in range(workers + 1)]
+        batches = []
+        starts = []
+        sizes = []
+        for b in range(workers):
+            block = range(blocks[b], blocks[b+1])
+            if len(block) > 0:
+                starts.append(blocks[b])
+                sizes.append(len(block))
+                batches.append(([points[n][0] for n in block], [points[n][1] for n in block], runsteps,
+                                [targets[n] for n in block] if any(targets) else None))
+                if keepgoing:
+                    batches[-1] = (batches[-1], retry)
+                if timing:
+                    batches[-1] = (runbatchjob, batches[-1])
+        if timing:
+            runbatchjob = _TimedJob
+        def collectblock(b, block):
+            block = Timed(starts[b], block, sizes[b], workers > 1)
+            return([collect(starts[b] + n, block[n]) for n in range(len(block))])
+        if workers > 1:
+            results = _PoolMap(runbatchjob, batches, workers, sessionclass, sessionargs, setup, collectblock)
+        else:
+            _UseSession(sessionclass, sessionargs, setup, session)
+            results = [collectblock(b, runbatchjob(batches[b])) for b in range(len(batches))]
+        return([rows for block in results for rows in block])
+    if warm and workers > 1:
+        sys.stderr.write("Warning. Warm-start continuation runs serially; --workers is ignored.\n")
+        workers = 1
+    if workers > 1:
+        return(_PoolMap(runjob, jobs, workers, sessionclass, sessionargs, setup,
+                        lambda n, result: collect(n, Timed(n, result, 1, True))))
+    _UseSession(sessionclass, sessionargs, setup, session)
+    if not warm:
+        return([collect(n, Timed(n, runjob(jobs[n]), 1, False)) for n in range(len(jobs))])
+    # Continuation: the swept value is applied on top of the final state of the last point that did not fail.
+    initial = _session.GetState()
+    results = []
+    try:
+        for n in range(len(jobs)):
+            if previous is not None:
+                _session.SetState(previous[1:len(_session.speciesids)+1])
+            results.append(collect(n, Timed(n, runjob(jobs[n]), 1, False)))
+            if n in finals:
+                previous = finals[n]
+    finally:
+        _session.SetState(initial)
+    return(results)
+
+# Sessions held by each worker process of a multi-model run, one per model file, loaded on first use.
+_sessionclass = None
+_sessions = {}
+
+def _StartModelWorker(sessionclass, sessions=None):
+    "Pool initialiser for multi-model runs. Models are loaded by _RunModelJob as they are first needed."
+    global _sessionclass, _sessions
+    _sessionclass = sessionclass
+    _sessions = sessions or {}
+
+def _RunModelJob(job):
+    "Simulates one (model, sweep point) pair against the session of that model in the current process."
+    global _session
+    filename, duration, message, overrides, steps, mode, settle, ensemble = job
+    if filename not in _sessions:
+        _sessions[filename] = _sessionclass(filename, duration)
+    _session = _sessions[filename]
+    return(_RunJob((message, overrides, steps, "", mode, settle, ensemble)))
+
+def RunModels(sessionclass, filenames, duration, points, steps, settings=None, sessions=None):
+    """RunModels function. Simulates the same sweep points on several models, spreading every (model, point) pair
+    over a process pool. Each process loads a model the first time it is given one of its points.
+    Arguments: 'filenames' lists the model files. 'duration' is the time course duration in seconds. 'points' is a
+    list of (message, overrides) pairs; a '{}' in a message is filled with the model filename. 'sessions' optionally
+    maps filenames to models already loaded, used by serial runs. 'settings' is the SweepSettings, of which the
+    workers, mode, settle & ensemble settings and the cache are used. Other arguments as for RunSweep.
+    Output: list, per model, of the list of row arrays in sweep order."""
+    if settings is None:
+        settings = SweepSettings()
+    workers, cache = settings.workers, settings.cache
+    jobs = [(filename, duration, message.format(filename), overrides, steps, settings.mode, settings.settle,
+             settings.ensemble) for filename in filenames for message, overrides in points]
+    keys = [None] * len(jobs)
+    results = [None] * len(jobs)
+    if cache is not None:
+        # The key holds each model's session tolerances, so sessions missing from 'sessions' are loaded here.
+        sessions = dict(sessions or {})
+        for filename in filenames:
+            if filename not in sessions:
+                sessions[filename] = sessionclass(filename, duration)
+        keys = [cache.Key(sessions[job[0]], (job[0], duration), [], job[3], steps, settings) for job in jobs]
+        results = [cache.Get(key) for key in keys]
+        print("{} of {} sweep points found in the cache.".format(len([r for r in results if r is not None]),
+                                                                len(jobs)))
+    missing = [n for n in range(len(jobs)) if results[n] is None]
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, _StartModelWorker, (sessionclass,))
+        try:
+            simulated = pool.map(_RunModelJob, [jobs[n] for n in missing], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _StartModelWorker(sessionclass, sessions)
+        simulated = [_RunModelJob(jobs[n]) for n in missing]
+    for n, rows in zip(missing, simulated):
+        if cache is not None:
+            cache.Put(keys[n], rows)
+        results[n] = rows
+    return([results[m*len(points):(m+1)*len(points)] for m in range(len(filenames))])
+
+def DumpCompiler(targets, dumpfilename, outputfilename):
+    """Appends the per-point paging files to the dump file in sweep order, then keeps the last one as the paging
+    file, as a serial run of the original scripts would leave it."""
+    # Failed points leave no paging file.
+    targets = [target for target in targets if os.path.exists(target)]
+    with open(dumpfilename, "w+") as dfn:
+        for target in targets:
+            with open(target, "r") as ofn:
+                dfn.writelines(ofn.readlines())
+    for target in targets[:-1]:
+        os.remove(target)
+    if targets:
+        if os.path.exists(outputfilename):
+            os.remove(outputfilename)
+        os.rename(targets[-1], outputfilename)
+
+def LineCompiler(linelist, output_filename):
+    "Sub-function to compile a list into a string and write it to a file."
+    output = open(output_filename, "a+")
+    for i in range(len(linelist)):
+        outputstr = ""
+        element = linelist[i]
+        for number in element:
+            appendstr = str(number).strip() + " "
+            outputstr = outputstr + appendstr
+        outputstr = outputstr + "\n"
+        output.write(outputstr)
+    output.close()
+
+def ScriptOptions(options):
+    """ScriptOptions function. Reads the options shared by ConcentrationRun.py and ParameterRun.py and settles their
+    conflicts, warning about each option that is ignored. Output: dictionary of the settings, keyed by option name.
+    Options: '--dump' writes the per-iteration report and dump files. '--times' is a comma-separated list of times in
+    seconds to keep from each time course. Default: the final time only. '--workers' is the number of processes to
+    spread the sweep points over. Default: 1. '--mode steady-state' runs COPASI's steady-state task for each point
+    instead of the full time course, falling back to the time course when no steady state is found. '--settle' is a
+    window in seconds: time courses stop once the change still to come, estimated over a window that long, is
+    below '--settle-rtol' & '--settle-atol', and the settling time is added as a last column. '--warm-start' starts each
+    point from the final state of the point before; combine with '--settle' for a short settle check per point.
+    '--hysteresis' sweeps back down after sweeping up, for use with '--warm-start'. '--engine numpy' simulates with the
+    COPASI-free numpy/scipy engine in MassActionModel.py instead of COPASI. '--cache' is a directory of cached sweep
+    point results, reused across runs; '--cache-size' limits it, in MB. '--spacing log' spaces the sweep evenly in log10
+    instead of linearly. '--adaptive' then bisects the intervals where the output changes fastest or curves most, up to
+    '--budget' points, until no interval changes by more than '--tolerance' of the '--output' species' range.
+    '--format columns' writes the parsed results as a binary column store directory instead of a text file.
+    '--trajectories' streams every point's full time course, every '--decimate' steps, to a compressed trajectory
+    store (TrajectoryStore.py) instead of the text dump file. Each finished point is checkpointed; a failing point is
+    recorded with its error text and skipped, with nan rows. '--resume' skips the points already checkpointed.
+    '--retry' reruns failing points once with both tolerances divided by its value. '--mode stochastic' (numpy
+    engines) runs an ensemble of '--ensemble' stochastic time courses per point, seeded by '--seed', and writes the
+    mean, variance & '--quantiles' of each species at each kept time instead of the deterministic values.
+    '--leap-epsilon', '--critical' & '--separation' tune its tau-leaping.
+    '--timing' prints the time spent in each phase of the run (model load, report setup, integration, parsing, file
+    I/O) with the run's counters, summed over worker processes, and writes the time & counters of each point to
+    Timing_<output file>. Solver statistics (function & Jacobian evaluations, LU decompositions, Newton
+    iterations, leaps) come from the numpy engines only; COPASI does not expose its LSODA statistics, so with
+    '--engine copasi' the counters are the number of integrations and steady-state solves."""
+    settings = {"dump": "dump" in options, "workers": int(options.get("workers", 1)), "mode": SweepMode(options),
+                "settle": SettleOptions(options), "ensemble": None, "cache": CacheOption(options),
+                "warm-start": "warm-start" in options, "hysteresis": "hysteresis" in options,
+                "spacing": options.get("spacing", "lin"), "format": FormatOption(options),
+                "trajectories": "trajectories" in options, "decimate": int(options.get("decimate", 1)),
+                "resume": "resume" in options, "retry": float(options["retry"]) if "retry" in options else None,
+                "timing": "timing" in options}
+    assert settings["workers"] >= 1
+    if settings["mode"] == "stochastic":
+        if settings["warm-start"] or settings["settle"] is not None:
+            sys.stderr.write("Warning. --mode stochastic ignores --warm-start and --settle.\n")
+        settings.update({"warm-start": False, "settle": None, "ensemble": EnsembleOptions(options)})
+    if "adaptive" in options and (settings["dump"] or settings["warm-start"] or settings["trajectories"] or
+                                  settings["resume"] or settings["hysteresis"]):
+        sys.stderr.write("Warning. --adaptive ignores --dump, --trajectories, --resume, --warm-start and "
+                         "--hysteresis.\n")
+        settings.update({"dump": False, "warm-start": False, "trajectories": False, "resume": False,
+                         "hysteresis": False})
+    if settings["resume"] and (settings["dump"] or settings["trajectories"]):
+        sys.stderr.write("Warning. --resume ignores --dump and --trajectories.\n")
+        settings.update({"dump": False, "trajectories": False})
+    if (settings["mode"] != "time-course" or settings["settle"] is not None) and (settings["dump"] or
+                                                                                  settings["trajectories"]):
+        sys.stderr.write("Warning. --dump & --trajectories have no effect in steady-state or stochastic mode or with "
+                         "--settle.\n")
+        settings.update({"dump": False, "trajectories": False})
+    return(settings)
+
+def ScriptSession(options, mode, filename, duration):
+    """Loads the model once for the whole sweep of a run script, with the session class of the '--engine' option.
+    Output: tuple of the session class & session, or None, with the error written, when the engine cannot run
+    'mode'."""
+    sessionclass = EngineClass(options)
+    if mode == "stochastic" and not hasattr(sessionclass, "RunEnsemble"):
+        sys.stderr.write("Error. --mode stochastic needs --engine numpy or batch.\n")
+        return(None)
+    return((sessionclass, sessionclass(filename, duration)))
+
+def ParsedHeader(speciesids, settings):
+    """Returns the parsed file header, which matches the report header: time, then the species in metabolite order,
+    then settling_time for time courses with '--settle'. Stochastic sweeps have the EnsembleColumns instead."""
+    if settings["mode"] == "stochastic":
+        return(EnsembleColumns(speciesids, settings["ensemble"][2]))
+    header = ["time"] + list(speciesids)
+    if settings["settle"] is not None and settings["mode"] == "time-course":
+        header.append("settling_time")
+    return(header)
+
+def ScriptMetadata(settings, sessionclass, filename, duration, steps, adaptive):
+    """Returns the description of a run script's sweep kept with its column store and trajectory store. The scripts
+    add the sweep axis and what it varies."""
+    return({"model": filename, "engine": sessionclass.name, "solver": sessionclass.solver, "mode": settings["mode"],
+            "duration": duration, "times": steps, "spacing": settings["spacing"], "adaptive": adaptive is not None,
+            "hysteresis": settings["hysteresis"], "warm_start": settings["warm-start"],
+            "ensemble": list(settings["ensemble"][:2]) + list(settings["ensemble"][3:])
+            if settings["mode"] == "stochastic" else None})
+
+def ScriptSweep(settings, sessionclass, sessionargs, setup, SweepPoint, values, steps, session, outputfilename,
+                adaptive, metadata):
+    """ScriptSweep function. Runs the sweep of ConcentrationRun.py or ParameterRun.py over 'values', as its settings
+    ask. 'SweepPoint' builds the (message, overrides) point of a value. '--hysteresis' sweeps back down the values
+    after sweeping up. '--dump' pages each point to its own file, compiled into the dump file once the sweep is done.
+    '--trajectories' streams full time courses to a store described by 'metadata'. Each point is checkpointed as it
+    finishes; with '--resume', points already done are not run again, and continuation reruns every point from the
+    first one missing, starting from the state before it. Failed points are warned about and kept in the checkpoint.
+    'adaptive' is the AdaptiveOptions tuple, or None; adaptive sweeps refine the values instead.
+    Output: tuple of the values swept and their row arrays, or the SimulationError of each failed point."""
+    from Checkpoint import Checkpoint, SweepKey
+    from TrajectoryStore import TrajectoryWriter
+    filename, duration = sessionargs
+    sweep = SweepSettings(settings["workers"], settings["mode"], settings["settle"], settings["ensemble"],
+                          settings["warm-start"], settings["cache"], True, settings["retry"], settings["timing"])
+    if adaptive is not None:
+        budget, tolerance, outputname = adaptive
+        speciesids = list(session.speciesids)
+        columns = [1 + speciesids.index(outputname)] if outputname else range(1, len(speciesids) + 1)
+        evaluate = lambda values: RunSweep(sessionclass, sessionargs, setup, [SweepPoint(value) for value in values],
+                                           steps, sweep.Copy(keepgoing=False, retry=None), session)
+        return(AdaptiveSweep(evaluate, values, settings["spacing"], budget, tolerance, columns))
+
+    if settings["hysteresis"]:
+        values = values + values[::-1]
+    points = [SweepPoint(value) for value in values]
+
+    # Each point writes its own paging file when dumping, so that points can run in any process.
+    targets = None
+    if settings["dump"]:
+        targets = [outputfilename[:-4] + "_" + str(n+1) + ".txt" for n in range(len(points))]
+
+    # Full time courses are streamed point by point to the trajectory store, in place of the dump file.
+    store = None
+    if settings["trajectories"]:
+        store = TrajectoryWriter("Trajectories_" + outputfilename[:-4], ["time"] + list(session.speciesids),
+                                 duration, settings["decimate"], dict(metadata, values=values))
+
+    checkpointfilename = "Checkpoint_" + outputfilename
+    try:
+        checkpoint = Checkpoint(checkpointfilename, SweepKey(sessionclass, sessionargs, setup, points, steps, sweep),
+                                settings["resume"])
+        todo, previous = checkpoint.Pending(len(points), sweep.warm)
+        simulated = RunSweep(sessionclass, sessionargs, setup, [points[n] for n in todo], steps, sweep, session,
+                             targets, store, lambda n, rows, final: checkpoint.Done(todo[n], rows, final), previous)
+        for record in phases.points:
+            record["point"] = todo[record["point"]]
+        results = [checkpoint.results.get(n) for n in range(len(points))]
+        for n, rows in zip(todo, simulated):
+            results[n] = rows
+        checkpoint.Finish(results)
+    finally:
+        if store is not None:
+            store.Close()
+
+    if targets is not None:
+        with phases.Phase("file I/O"):
+            DumpCompiler(targets, "Dump_" + outputfilename, outputfilename)
+    return((values, results))
+
+def WriteParsed(settings, header, steps, labels, results, parsedfilename, metadata):
+    """Writes the parsed results of a run script, as a text file or, with '--format columns', as a column store
+    directory named as the parsed file without the extension. Each kept row starts with its point's label from
+    'labels', under the sweep axis named in 'metadata'. Failed points keep their place in the sweep with rows of
+    nan."""
+    from ColumnStore import WriteColumns
+    with phases.Phase("parsing"):
+        single = settings["mode"] == "steady-state" or (settings["mode"] == "time-course" and
+                                                        settings["settle"] is not None)
+        failedrows = [[float("nan")] * len(header)] * (1 if single else len(steps))
+        parsedlines = []
+        for n in range(len(results)):
+            rows = failedrows if isinstance(results[n], SimulationError) else results[n]
+            for row in rows:
+                lineparsed = [float(x) for x in row]
+                lineparsed.insert(0, labels[n])
+                parsedlines.append(lineparsed)
+
+    with phases.Phase("file I/O"):
+        if settings["format"] == "columns":
+            WriteColumns(parsedfilename[:-4], [metadata["axis"]] + header, parsedlines, metadata)
+        else:
+            with open(parsedfilename, "w+") as pfn:
+                pfn.write(", ".join(header) + "\n")
+            LineCompiler(parsedlines, parsedfilename)
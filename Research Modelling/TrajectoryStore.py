@@ -0,0 +1,99 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+import numpy as np
+import json
+import zlib
+import os
+
+# Files of a trajectory store directory: the header, the compressed blocks and the block index.
+HEADER = "header.json"
+BLOCKS = "blocks.bin"
+INDEX = "index.txt"
+
+class TrajectoryWriter(object):
+    """Streaming store of the full time courses of a sweep. Each point's time course is cut into blocks of
+    'chunkrows' rows, compressed with zlib and appended to the block file as soon as the point is simulated, so
+    memory use does not grow with the sweep. One index line per block records its point, first row, row count, time
+    range and position in the block file.
+    Arguments: 'dirname' is the store directory, created if needed. 'columns' lists the column names, time first.
+    'duration' is the time course duration in seconds. 'decimate' keeps every n-th step; the final step is always
+    kept. 'metadata' is a dictionary of run settings, stored in the header."""
+
+    def __init__(self, dirname, columns, duration, decimate=1, metadata=None, chunkrows=4096):
+        assert decimate >= 1
+        self.columns = list(columns)
+        self.chunkrows = chunkrows
+        self.steps = sorted(set(range(0, duration + 1, decimate)) | set([duration]))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        header = {"columns": self.columns, "duration": duration, "step": decimate, "chunkrows": chunkrows,
+                  "dtype": "<f8", "compression": "zlib", "metadata": metadata or {}}
+        with open(os.path.join(dirname, HEADER), "w+") as hfn:
+            json.dump(header, hfn, indent=1)
+        self.blockfile = open(os.path.join(dirname, BLOCKS), "wb")
+        self.indexfile = open(os.path.join(dirname, INDEX), "w")
+
+    def Write(self, point, rows):
+        """Compresses & appends the recorded rows of one sweep point. 'point' is its index in sweep order, from 0.
+        Both files are flushed, so a reader or an interrupted run sees every point written so far."""
+        rows = np.ascontiguousarray(rows, dtype="<f8")
+        assert rows.shape[1] == len(self.columns)
+        for start in range(0, rows.shape[0], self.chunkrows):
+            block = rows[start:start + self.chunkrows]
+            data = zlib.compress(block.tobytes(), 6)
+            offset = self.blockfile.tell()
+            self.blockfile.write(data)
+            self.indexfile.write("{} {} {} {!r} {!r} {} {}\n".format(point, start, block.shape[0], float(block[0, 0]),
+                                                                      float(block[-1, 0]), offset, len(data)))
+        self.blockfile.flush()
+        self.indexfile.flush()
+
+    def Close(self):
+        self.blockfile.close()
+        self.indexfile.close()
+
+class TrajectoryReader(object):
+    """Reads a trajectory store written by TrajectoryWriter. Only the index is held in memory; Read decompresses
+    just the blocks of one point that overlap the time range asked for."""
+
+    def __init__(self, dirname):
+        with open(os.path.join(dirname, HEADER)) as hfn:
+            self.header = json.load(hfn)
+        self.columns = self.header["columns"]
+        self.blocks = {}
+        with open(os.path.join(dirname, INDEX)) as ifn:
+            for line in ifn:
+                fields = line.split()
+                if len(fields) != 7:
+                    # A partly written last line, from an interrupted run.
+                    continue
+                point = int(fields[0])
+                self.blocks.setdefault(point, []).append((float(fields[3]), float(fields[4]), int(fields[5]),
+                                                          int(fields[6])))
+        self.blockfile = open(os.path.join(dirname, BLOCKS), "rb")
+
+    def Points(self):
+        "Returns the indices of the sweep points held, in sweep order."
+        return(sorted(self.blocks))
+
+    def Read(self, point, start=None, end=None):
+        """Returns the recorded rows of one sweep point, time followed by species concentrations, optionally only
+        those with 'start' <= time <= 'end'."""
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+        parts = []
+        for first, last, offset, length in self.blocks[point]:
+            if last < start or first > end:
+                continue
+            self.blockfile.seek(offset)
+            data = zlib.decompress(self.blockfile.read(length))
+            parts.append(np.frombuffer(data, dtype="<f8").reshape(-1, len(self.columns)))
+        if not parts:
+            return(np.empty((0, len(self.columns))))
+        rows = np.vstack(parts)
+        return(rows[(rows[:, 0] >= start) & (rows[:, 0] <= end)])
+
+    def Close(self):
+        self.blockfile.close()
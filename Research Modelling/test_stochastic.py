@@ -0,0 +1,279 @@
+#!/usr/bin/python
+
+# Author: Adam Bannister, Newcastle University.
+
+from MassActionModel import MassActionSession, SplitRate, Depends, AVOGADRO
+from SweepTools import phases
+import numpy as np
+import tempfile
+import unittest
+import os
+
+# Reversible binding A + B <-> C in a 1e-12 ml cell, started from {0} molecules each of A & B, with binding constant
+# {1} per molecule pair per second and unbinding 0.05 per second.
+BINDING = """<?xml version="1.0" encoding="UTF-8"?>
+<sbml xmlns="http://www.sbml.org/sbml/level2/version4" level="2" version="4">
+  <model id="binding">
+    <listOfCompartments>
+      <compartment id="cell" size="1e-12"/>
+    </listOfCompartments>
+    <listOfSpecies>
+      <species id="A" compartment="cell" initialConcentration="{0!r}"/>
+      <species id="B" compartment="cell" initialConcentration="{0!r}"/>
+      <species id="C" compartment="cell" initialConcentration="0"/>
+    </listOfSpecies>
+    <listOfReactions>
+      <reaction id="binding" reversible="true">
+        <listOfReactants>
+          <speciesReference species="A"/>
+          <speciesReference species="B"/>
+        </listOfReactants>
+        <listOfProducts>
+          <speciesReference species="C"/>
+        </listOfProducts>
+        <kineticLaw>
+          <math xmlns="http://www.w3.org/1998/Math/MathML">
+            <apply><times/><ci>cell</ci>
+              <apply><minus/>
+                <apply><times/><ci>k1</ci><ci>A</ci><ci>B</ci></apply>
+                <apply><times/><ci>k2</ci><ci>C</ci></apply>
+              </apply>
+            </apply>
+          </math>
+          <listOfParameters>
+            <parameter id="k1" value="{1!r}"/>
+            <parameter id="k2" value="0.05"/>
+          </listOfParameters>
+        </kineticLaw>
+      </reaction>
+    </listOfReactions>
+  </model>
+</sbml>
+"""
+
+# A gene with 5 promoter copies G, bound & released by an inducer I of 100000 molecules 4 & 1 times per second, as the
+# Model Files promoters are. Free promoters transcribe mRNA M, about 5 copies, which is translated into protein P,
+# about 1250 copies.
+PROMOTER = """<?xml version="1.0" encoding="UTF-8"?>
+<sbml xmlns="http://www.sbml.org/sbml/level2/version4" level="2" version="4">
+  <model id="promoter">
+    <listOfCompartments>
+      <compartment id="cell" size="1e-12"/>
+    </listOfCompartments>
+    <listOfSpecies>
+      <species id="G" compartment="cell" initialConcentration="{0!r}"/>
+      <species id="I" compartment="cell" initialConcentration="{1!r}"/>
+      <species id="GI" compartment="cell" initialConcentration="0"/>
+      <species id="M" compartment="cell" initialConcentration="0"/>
+      <species id="P" compartment="cell" initialConcentration="0"/>
+    </listOfSpecies>
+    <listOfReactions>
+      <reaction id="binding" reversible="true">
+        <listOfReactants>
+          <speciesReference species="G"/>
+          <speciesReference species="I"/>
+        </listOfReactants>
+        <listOfProducts>
+          <speciesReference species="GI"/>
+        </listOfProducts>
+        <kineticLaw>
+          <math xmlns="http://www.w3.org/1998/Math/MathML">
+            <apply><times/><ci>cell</ci>
+              <apply><minus/>
+                <apply><times/><ci>k1</ci><ci>G</ci><ci>I</ci></apply>
+                <apply><times/><ci>k2</ci><ci>GI</ci></apply>
+              </apply>
+            </apply>
+          </math>
+          <listOfParameters>
+            <parameter id="k1" value="{2!r}"/>
+            <parameter id="k2" value="1"/>
+          </listOfParameters>
+        </kineticLaw>
+      </reaction>
+      <reaction id="transcription" reversible="false">
+        <listOfReactants>
+          <speciesReference species="G"/>
+        </listOfReactants>
+        <listOfProducts>
+          <speciesReference species="G"/>
+          <speciesReference species="M"/>
+        </listOfProducts>
+        <kineticLaw>
+          <math xmlns="http://www.w3.org/1998/Math/MathML">
+            <apply><times/><ci>cell</ci><ci>k1</ci><ci>G</ci></apply>
+          </math>
+          <listOfParameters>
+            <parameter id="k1" value="0.05"/>
+          </listOfParameters>
+        </kineticLaw>
+      </reaction>
+      <reaction id="mRNA_degradation" reversible="false">
+        <listOfReactants>
+          <speciesReference species="M"/>
+        </listOfReactants>
+        <kineticLaw>
+          <math xmlns="http://www.w3.org/1998/Math/MathML">
+            <apply><times/><ci>cell</ci><ci>k1</ci><ci>M</ci></apply>
+          </math>
+          <listOfParameters>
+            <parameter id="k1" value="0.01"/>
+          </listOfParameters>
+        </kineticLaw>
+      </reaction>
+      <reaction id="translation" reversible="false">
+        <listOfReactants>
+          <speciesReference species="M"/>
+        </listOfReactants>
+        <listOfProducts>
+          <speciesReference species="M"/>
+          <speciesReference species="P"/>
+        </listOfProducts>
+        <kineticLaw>
+          <math xmlns="http://www.w3.org/1998/Math/MathML">
+            <apply><times/><ci>cell</ci><ci>k1</ci><ci>M</ci></apply>
+          </math>
+          <listOfParameters>
+            <parameter id="k1" value="0.5"/>
+          </listOfParameters>
+        </kineticLaw>
+      </reaction>
+      <reaction id="protein_degradation" reversible="false">
+        <listOfReactants>
+          <speciesReference species="P"/>
+        </listOfReactants>
+        <kineticLaw>
+          <math xmlns="http://www.w3.org/1998/Math/MathML">
+            <apply><times/><ci>cell</ci><ci>k1</ci><ci>P</ci></apply>
+          </math>
+          <listOfParameters>
+            <parameter id="k1" value="0.002"/>
+          </listOfParameters>
+        </kineticLaw>
+      </reaction>
+    </listOfReactions>
+  </model>
+</sbml>
+"""
+
+def Write(text):
+    "Writes model 'text' to a temporary file. Output: its name."
+    handle, filename = tempfile.mkstemp(suffix=".xml")
+    with os.fdopen(handle, "w") as mfn:
+        mfn.write(text)
+    return(filename)
+
+def Binding(molecules, constant):
+    "Writes the binding model for 'molecules' of A & B and binding 'constant' to a temporary file. Output: its name."
+    return(Write(BINDING.format(molecules / (AVOGADRO * 1.0e-12), constant * AVOGADRO * 1.0e-12)))
+
+class StochasticTest(unittest.TestCase):
+    "Checks the stochastic ensemble of MassActionModel.py against the rate equations on a reversible reaction."
+
+    def setUp(self):
+        # 100 molecules of A & B: at equilibrium roughly 15 are bound and both directions fire steadily.
+        self.filename = Binding(100, 1.0e-4)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def Check(self, session, size):
+        "Runs an ensemble of 'size' and checks its means match the rate equations, within sampling error."
+        steps = [500, 2000]
+        deterministic = session.Run(steps)
+        ensemble = session.RunEnsemble(steps, size, 1, [0.5])
+        count = len(session.speciesids)
+        means = ensemble[-1, 1:count+1]
+        errors = np.sqrt(ensemble[-1, count+1:2*count+1] / size)
+        self.assertTrue(np.all(np.abs(means - deterministic[-1, 1:]) <= 5 * errors + 0.02 * deterministic[-1, 1:]),
+                        (means, deterministic[-1, 1:]))
+        return(means)
+
+    def testSplitRate(self):
+        "A reversible law splits into forward & reverse channels, each firing the reaction one way."
+        session = MassActionSession(self.filename, 2000)
+        network = session.network
+        forward, reverse = SplitRate(network.ratetrees[0])
+        self.assertEqual([Depends(forward, name) for name in ("A", "B", "C", "binding.k1", "binding.k2")],
+                         [True, True, False, True, False])
+        self.assertEqual([Depends(reverse, name) for name in ("A", "B", "C", "binding.k1", "binding.k2")],
+                         [False, False, True, False, True])
+        self.assertEqual(network.channelstoichiometry.shape, (3, 2))
+        self.assertEqual(list(network.channelstoichiometry[:, 1]), list(-network.channelstoichiometry[:, 0]))
+        self.assertEqual(list(network.channelreactants[:, 1]), [0.0, 0.0, 1.0])
+        state = np.array([1.0e-7, 2.0e-7, 3.0e-7])
+        # In molecules per second, so the tolerance is relative to rates of order one.
+        propensities = network.Propensities(state, session.parameters) * AVOGADRO
+        self.assertTrue(np.all(propensities > 0))
+        np.testing.assert_allclose(propensities[0] - propensities[1],
+                                   network.Rates(state, session.parameters)[0] * AVOGADRO, rtol=1.0e-12)
+
+    def testEnsembleMeans(self):
+        "Ensemble means at equilibrium match the rate equations, within sampling error."
+        session = MassActionSession(self.filename, 2000)
+        means = self.Check(session, 400)
+        # Without unbinding, nearly all of A would be bound by the end.
+        self.assertLess(means[2], 0.5 * session.network.initial[0])
+
+    def testLeaps(self):
+        """With 100000 molecules no channel is critical and the ensemble moves by tau-leaps: each trajectory takes a
+        few hundred leaps & exact steps (the latter while C is scarce, early on) where about 3 million reactions fire.
+        Its means still match the rate equations."""
+        filename = Binding(100000, 1.0e-7)
+        try:
+            session = MassActionSession(filename, 2000)
+            phases.Reset()
+            self.Check(session, 200)
+            self.assertGreater(phases.counters.get("leaps", 0), 0)
+            self.assertEqual(phases.counters.get("critical firings", 0), 0)
+            self.assertLess(phases.counters.get("exact steps", 0) + phases.counters["leaps"], 1000 * 200)
+        finally:
+            os.remove(filename)
+
+    def testCriticalChannels(self):
+        """With a single molecule of A & B both binding & unbinding are critical: without equilibria they fire one at
+        a time, and with no critical channels the trajectories take exact steps instead. With equilibria the binding
+        is taken at equilibrium, nothing else being left to fire."""
+        filename = Binding(1, 1.0e-4)
+        try:
+            session = MassActionSession(filename, 2000)
+            phases.Reset()
+            session.RunEnsemble([2000], 50, 1, [0.5], separation=0.0)
+            self.assertGreater(phases.counters.get("critical firings", 0) + phases.counters.get("exact steps", 0), 0)
+            self.assertEqual(phases.counters.get("equilibrium draws", 0), 0)
+            phases.Reset()
+            session.RunEnsemble([2000], 50, 1, [0.5], critical=0)
+            self.assertEqual(phases.counters.get("critical firings", 0), 0)
+            self.assertEqual(phases.counters.get("equilibrium draws", 0), 0)
+            self.assertGreater(phases.counters.get("exact steps", 0), 0)
+            phases.Reset()
+            session.RunEnsemble([2000], 50, 1, [0.5])
+            self.assertGreater(phases.counters.get("equilibrium draws", 0), 0)
+            self.assertEqual(phases.counters.get("critical firings", 0) + phases.counters.get("exact steps", 0), 0)
+        finally:
+            os.remove(filename)
+
+    def testPromoter(self):
+        """On a gene like the Model Files circuits the promoter binding is taken at equilibrium, the scarce mRNA
+        changes one critical firing at a time within leaps of the protein, and the means still match the rate
+        equations, which are exact for this linear network. Simulating every promoter event instead gives the same
+        result in many more steps."""
+        filename = Write(PROMOTER.format(5 / (AVOGADRO * 1.0e-12), 100000 / (AVOGADRO * 1.0e-12),
+                                         4.0e-5 * AVOGADRO * 1.0e-12))
+        try:
+            session = MassActionSession(filename, 2000)
+            phases.Reset()
+            self.Check(session, 400)
+            self.assertGreater(phases.counters.get("equilibrium draws", 0), 0)
+            self.assertGreater(phases.counters.get("critical firings", 0), 0)
+            self.assertGreater(phases.counters.get("leaps", 0), 0)
+            fast = phases.counters.get("exact steps", 0) + phases.counters["leaps"]
+            phases.Reset()
+            session.RunEnsemble([500, 2000], 400, 1, [0.5], separation=0.0)
+            self.assertEqual(phases.counters.get("equilibrium draws", 0), 0)
+            self.assertGreater(phases.counters.get("exact steps", 0) + phases.counters.get("leaps", 0), 10 * fast)
+        finally:
+            os.remove(filename)
+
+if (__name__ == '__main__'):
+    unittest.main()